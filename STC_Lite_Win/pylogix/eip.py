@@ -117,7 +117,12 @@ class PLC(object):
                     return [self._read_tag(*tag[0])]
                 else:
                     return [self._read_tag(tag[0], count, datatype)]
-            if self.Micro800:
+            multi_service = self._micro800_multi_service() if self.Micro800 else True
+            if multi_service is None:
+                # controller could not be reached, don't connect again for the batch
+                return [Response(t, None, 1) for t in tag]
+            elif multi_service is False:
+                # controller rejected the multiple service packet, read one at a time
                 if isinstance(tag[0], (list, tuple)):
                     return [self._read_tag(*t) for t in tag]
                 else:
@@ -137,6 +142,13 @@ class PLC(object):
         if isinstance(tag, (list, tuple)):
             if len(tag) == 1:
                 return [self._write_tag(*tag[0])]
+            multi_service = self._micro800_multi_service() if self.Micro800 else True
+            if multi_service is None:
+                # controller could not be reached, don't connect again for the batch
+                return [Response(t[0], None, 1) for t in tag]
+            elif multi_service is False:
+                # controller rejected the multiple service packet, write one at a time
+                return [self._write_tag(*t) for t in tag]
             else:
                 return self._batch_write(tag)
         else:
@@ -281,7 +293,7 @@ class PLC(object):
         Processes the multiple read request. Split into multiple requests and
         reassemble responses when needed
         """
-        if self.Micro800:
+        if self.Micro800 and self.conn.MultiServicePacket is False:
             return Response(tags, None, 8)
 
         conn = self.conn.connect()
@@ -302,6 +314,30 @@ class PLC(object):
 
         return result
 
+    def _micro800_multi_service(self):
+        """
+        Not every Micro800 firmware supports the multiple service packet,
+        so probe the controller once per connection.  Returns True/False, or
+        None when the controller could not be reached to find out
+        """
+        conn = self.conn.connect()
+        if not conn[0]:
+            return None
+
+        if self.conn.MultiServicePacket is None:
+            # two Get Attribute Single requests for the identity object vendor ID,
+            # which every CIP device supports
+            service = self._cip_message(0x0e, 0x01, 0x01, 0x01)
+            header = self._build_multi_service_header()
+            offsets = pack('<HH', 6, 6 + len(service))
+            request = header + pack('<H', 2) + offsets + service + service
+            status, ret_data = self.conn.send(request)
+            if not ret_data:
+                return None
+            self.conn.MultiServicePacket = status == 0 or status == 0x1e
+
+        return self.conn.MultiServicePacket
+
     def _read_tag(self, tag_name, elements, data_type):
         """
         Processes the read request
@@ -398,6 +434,9 @@ class PLC(object):
                 dt_size = self.CIPTypes[data_type][0]
                 if data_type == 0xa0:
                     dt_size -= 8
+                elif data_type == 0xda:
+                    # Micro800 string, length byte plus up to 255 characters
+                    dt_size = 256
             else:
                 # go with the worst case size
                 dt_size = self.CIPTypes[160][0]
@@ -442,6 +481,12 @@ class PLC(object):
         if not ret_data:
             return [Response(t, None, status) for t in tags]
 
+        # Micro800 rejected the multiple service packet, fall back to single reads
+        if self.Micro800 and status == 0x08:
+            self.conn.MultiServicePacket = False
+            return [self._read_tag(*t) if isinstance(t, (list, tuple)) else self._read_tag(t, 1, None)
+                    for t in tags]
+
         return self._parse_multi_read(tags_effective, ret_data)
 
     def _batch_write(self, tags):
@@ -449,7 +494,7 @@ class PLC(object):
         Processes the multiple write request. Split into multiple requests and
         reassemble responses when needed
         """
-        if self.Micro800:
+        if self.Micro800 and self.conn.MultiServicePacket is False:
             return Response(tags, None, 8)
 
         conn = self.conn.connect()
@@ -575,6 +620,10 @@ class PLC(object):
             else:
                 value = [value]
 
+            if data_type == 0xda:
+                # Micro800 string, length byte plus the characters being written
+                dt_size = sum(1 + len(str(v)) for v in value)
+
             rsp_tag_size = min_tag_size + len(base_tag) + dt_size
 
             if bit_of_word(tag_name) or data_type == 0xd3:
@@ -641,6 +690,11 @@ class PLC(object):
         if not ret_data:
             return [Response(w[0], w[1], status) for w in write_data]
 
+        # Micro800 rejected the multiple service packet, fall back to single writes
+        if self.Micro800 and status == 0x08:
+            self.conn.MultiServicePacket = False
+            return [self._write_tag(*w) for w in write_data]
+
         return self._parse_multi_write(write_values, ret_data)
 
     def _get_plc_time(self, raw=False):
@@ -1446,6 +1500,12 @@ class PLC(object):
                     s = stripped[offset + 12:offset + 12 + strlen]
                     value = str(s.decode(self.StringEncoding))
                     response = Response(tag, value, status)
+                elif data_type == 0xda:
+                    # Micro800 string, single byte length
+                    strlen = unpack_from('<B', stripped, offset + 6)[0]
+                    s = stripped[offset + 7:offset + 7 + strlen]
+                    value = str(s.decode(self.StringEncoding))
+                    response = Response(tag, value, status)
                 else:
                     type_fmt = self.CIPTypes[data_type][2]
                     # handling special format for micropython for bools
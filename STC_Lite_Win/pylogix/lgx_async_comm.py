@@ -0,0 +1,245 @@
+"""
+   Copyright 2022 Dustin Roeder (dmroeder@gmail.com)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import asyncio
+
+from struct import unpack_from
+
+from .lgx_comm import Connection
+
+
+class AsyncConnection(Connection):
+    """
+    asyncio variant of Connection.  Packets are built by the same methods
+    as Connection, only the transport is replaced by asyncio streams so
+    several PLCs can be polled from one event loop without threads.
+
+    The parent is a PLC (or any object with the same IPAddress, Port,
+    SocketTimeout, Micro800, Route and ProcessorSlot attributes).
+    """
+
+    def __init__(self, parent):
+        super(AsyncConnection, self).__init__(parent)
+        # the blocking socket created by Connection is never used
+        self.Socket.close()
+        self.Socket = None
+
+        self._reader = None
+        self._writer = None
+
+    async def connect(self, connected=True):
+        """
+        Connect to the PLC
+        """
+        return await self._connect(connected)
+
+    async def send(self, request, connected=True, slot=None):
+        """
+        Send the request to the PLC
+        Return the status and data
+        """
+        if connected:
+            eip_header = self._build_eip_header(request)
+        else:
+            if self.parent.Route or slot is not None:
+                path = self._unconnected_path(slot)
+                frame = self._build_unconnected_send(len(request)) + request + path
+            else:
+                frame = request
+            eip_header = self._build_rr_data_header(len(frame)) + frame
+
+        return await self._get_bytes(eip_header, connected)
+
+    async def close(self):
+        """
+        Close the connection
+        """
+        await self._close_connection()
+
+    async def _connect(self, connected):
+        """
+        Open a connection to the PLC.
+        """
+        if self.SocketConnected:
+            if connected and not self._connected:
+                # connection type changed, need to close, so we can reconnect
+                await self._close_connection()
+            elif not connected and self._connected:
+                # connection type changed, need to close, so we can reconnect
+                await self._close_connection()
+            else:
+                return [True, 'Success']
+
+        self.MultiServicePacket = None
+        await self._close_transport()
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.parent.IPAddress, self.parent.Port),
+                self.parent.SocketTimeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            self.SocketConnected = False
+            self._sequence_counter = 1
+            await self._close_transport()
+            return [False, e]
+
+        # register the session
+        if not await self._register_session():
+            self.SocketConnected = False
+            return [False, 'Register session failed']
+
+        if connected:
+            if self.ConnectionSize is not None:
+                ret = await self._forward_open()
+            else:
+                # try a large forward open by default
+                self.ConnectionSize = 4002
+                ret = await self._forward_open()
+
+                # if large forward open fails, try a normal forward open
+                if not ret[0]:
+                    self.ConnectionSize = 504
+                    ret = await self._forward_open()
+
+                # neither size was accepted (usually the PLC is unreachable), so
+                # nothing was negotiated, start with a large forward open next time
+                if not ret[0]:
+                    self.ConnectionSize = None
+
+            return ret
+
+        self.SocketConnected = True
+        return [self.SocketConnected, 'Success']
+
+    async def _register_session(self):
+        """
+        Register our CIP session, returns True when successful
+        """
+        try:
+            await self._write(self._build_register_session())
+            ret_data = await self.receive_data()
+        except (OSError, asyncio.TimeoutError):
+            ret_data = None
+
+        if ret_data:
+            self._session_handle = unpack_from('<I', ret_data, 4)[0]
+            self._registered = True
+            return True
+
+        return False
+
+    async def _forward_open(self):
+        """
+        ForwardOpen connection.
+        """
+        try:
+            await self._write(self._build_forward_open_packet())
+            ret_data = await self.receive_data()
+        except (OSError, asyncio.TimeoutError) as e:
+            self.SocketConnected = False
+            return [False, e]
+
+        if not ret_data:
+            self.SocketConnected = False
+            return [False, 'Forward open failed']
+
+        sts = unpack_from('<b', ret_data, 42)[0]
+        if not sts:
+            self._ot_connection_id = unpack_from('<I', ret_data, 44)[0]
+            self._connected = True
+        else:
+            self.SocketConnected = False
+            return [False, 'Forward open failed']
+
+        self.SocketConnected = True
+        return [self.SocketConnected, 'Success']
+
+    async def _close_connection(self):
+        """
+        Close the connection to the PLC (forward close, unregister session)
+        """
+        self.SocketConnected = False
+        try:
+            if self._connected:
+                await self._write(self._build_forward_close_packet())
+                await self.receive_data()
+                self._connected = False
+            if self._registered:
+                await self._write(self._build_unregister_session())
+                self._registered = False
+        except (Exception,):
+            pass
+        finally:
+            await self._close_transport()
+
+    async def _close_transport(self):
+        """
+        Close the stream, ignoring errors from a connection that is already gone
+        """
+        writer = self._writer
+        self._reader = None
+        self._writer = None
+        if writer is not None:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except (Exception,):
+                pass
+
+    async def _get_bytes(self, data, connected):
+        """
+        Sends data and gets the return data
+        """
+        try:
+            await self._write(data)
+            ret_data = await self.receive_data()
+            if ret_data:
+                if connected:
+                    status = unpack_from('<B', ret_data, 48)[0]
+                else:
+                    status = unpack_from('<B', ret_data, 42)[0]
+                return status, ret_data
+            else:
+                self.SocketConnected = False
+                return 1, None
+        except (OSError, asyncio.TimeoutError):
+            self.SocketConnected = False
+            return 1, None
+
+    async def _write(self, data):
+        """
+        Write a packet to the stream and wait for it to drain
+        """
+        if self._writer is None:
+            raise ConnectionResetError('Not connected')
+        self._writer.write(data)
+        await asyncio.wait_for(self._writer.drain(), self.parent.SocketTimeout)
+
+    async def receive_data(self):
+        """
+        Read one complete EtherNet/IP packet.  The 24 byte encapsulation
+        header contains the payload length, so the stream can be read
+        exactly instead of looping on partial receives.
+        """
+        if self._reader is None:
+            return None
+
+        try:
+            header = await asyncio.wait_for(self._reader.readexactly(24), self.parent.SocketTimeout)
+            payload_len = unpack_from('<H', header, 2)[0]
+            payload = await asyncio.wait_for(self._reader.readexactly(payload_len), self.parent.SocketTimeout)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, OSError):
+            return None
+
+        return header + payload
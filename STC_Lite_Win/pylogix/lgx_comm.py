@@ -31,6 +31,7 @@ class Connection(object):
         self.parent = parent
 
         self.ConnectionSize = None  # Default to try Large, then Small Fwd Open.
+        self.MultiServicePacket = None  # Micro800 multiple service support, probed per connection
         self.Socket = socket.socket()
         self.SocketConnected = False
 
@@ -88,6 +89,7 @@ class Connection(object):
             else:
                 return [True, 'Success']
 
+        self.MultiServicePacket = None
         try:
             try:
                 self.Socket.close()
@@ -140,6 +142,11 @@ class Connection(object):
                     self.ConnectionSize = 504
                     ret = self._forward_open()
 
+                # neither size was accepted (usually the PLC is unreachable), so
+                # nothing was negotiated, start with a large forward open next time
+                if not ret[0]:
+                    self.ConnectionSize = None
+
             return ret
 
         self.SocketConnected = True
@@ -0,0 +1,50 @@
+import json
+import time
+import stc_lite
+
+
+def make_rows(count: int) -> list:
+    timestamp = int(round(time.time() * 1000))
+    rows = []
+    for i in range(count):
+        rows.append({
+            'time': timestamp,
+            'quality': 'GOOD',
+            'name': f'Analog_In_{i}',
+            'value': {
+                'value': round(i * 1.37, 2),
+                'baseType': 'NUMBER'
+            }
+        })
+
+    return rows
+
+
+def dict_body(rows: list) -> bytes:
+    # how the upload body was built before: whole envelope through json.dumps
+    return json.dumps({'values': {'rows': rows.copy(), 'dataShape': stc_lite.TWX_DATASHAPE}}).encode('utf-8')
+
+
+def stdlib_body(rows: list) -> bytes:
+    return stc_lite.build_twx_values(rows, lambda data: json.dumps(data, separators = (',', ':')).encode('utf-8'))
+
+
+encoders = {
+    'json.dumps envelope': dict_body,
+    'pre-encoded + json': stdlib_body,
+}
+if stc_lite.orjson is not None:
+    encoders['pre-encoded + orjson'] = stc_lite.build_twx_values
+
+for row_count in (10, 100, 1000):
+    rows = make_rows(row_count)
+    iterations = max(20, 20000 // row_count)
+    for name, encoder in encoders.items():
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        for _ in range(iterations):
+            body = encoder(rows)
+
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        print(f'{row_count:>5} rows  {name:<22} {len(body):>8} bytes  {len(body) * iterations / wall / 1e6:8.1f} MB/s  {cpu / iterations * 1e6:9.1f} us CPU/upload')
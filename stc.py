@@ -4,35 +4,37 @@ import stc_lite
 
 async def main():
     sanitrend_cloud_lite = stc_lite.STC()
+    await sanitrend_cloud_lite.start()
+    try:
+        await scan_loop(sanitrend_cloud_lite)
+
+    finally:
+        await sanitrend_cloud_lite.close()
+
+
+async def scan_loop(sanitrend_cloud_lite: stc_lite.STC) -> None:
     run_code = True
 
     while run_code:
         try:
-            if sanitrend_cloud_lite.plc_scan_timer():
-                asyncio.create_task(sanitrend_cloud_lite.get_twx_connection_status())
-                asyncio.create_task(sanitrend_cloud_lite.get_stc_config())
-                for tag in sanitrend_cloud_lite.plc_tag_list:
-                    asyncio.create_task(sanitrend_cloud_lite.read_tags(tag))
-                
-                plc_watchdog = stc_lite.get_tag_value(sanitrend_cloud_lite.plc_data, 'PLC_Watchdog')
-                sanitrend_watchdog = stc_lite.get_tag_value(sanitrend_cloud_lite.plc_data, 'SaniTrend_Watchdog')
-                thingworx_alarm = stc_lite.get_tag_value(sanitrend_cloud_lite.plc_data, 'Twx_Alarm')
-                thingworx_alarm_status = not sanitrend_cloud_lite.twx_connected
-                comms_data = []
-                if sanitrend_watchdog != plc_watchdog:
-                    if sanitrend_watchdog is not None and plc_watchdog is not None:
-                        comms_data.append(('SaniTrend_Watchdog', plc_watchdog))
-
-                if thingworx_alarm != thingworx_alarm_status:
-                    if thingworx_alarm is not None:
-                        comms_data.append(('Twx_Alarm', thingworx_alarm_status))
-                
-                if len(comms_data) > 0:
-                    asyncio.create_task(sanitrend_cloud_lite.write_tags(comms_data))
-
-                asyncio.create_task(sanitrend_cloud_lite.upload_tag_data_to_twx())
+            await sanitrend_cloud_lite.plc_scheduler.wait()
+            supervisor = sanitrend_cloud_lite.supervisor
+            supervisor.spawn('twx_connection_status', sanitrend_cloud_lite.get_twx_connection_status)
+            supervisor.spawn('stc_config', sanitrend_cloud_lite.get_stc_config)
+            supervisor.spawn('scan_tags', sanitrend_cloud_lite.scan_tags)
             
-            await asyncio.sleep(0.5)
+            thingworx_alarm = stc_lite.get_tag_value(sanitrend_cloud_lite.plc_data, 'Twx_Alarm')
+            thingworx_alarm_status = not sanitrend_cloud_lite.twx_connected
+            comms_data = []
+            if thingworx_alarm != thingworx_alarm_status:
+                if thingworx_alarm is not None:
+                    comms_data.append(('Twx_Alarm', thingworx_alarm_status))
+            
+            if len(comms_data) > 0:
+                supervisor.spawn('write_comms', sanitrend_cloud_lite.write_tags, comms_data)
+
+            supervisor.spawn('upload_tag_data', sanitrend_cloud_lite.upload_tag_data_to_twx)
+            supervisor.spawn('log_metrics', sanitrend_cloud_lite.log_metrics)
 
             reboot = stc_lite.get_tag_value(sanitrend_cloud_lite.plc_data, 'Reboot')
             if reboot:
@@ -45,13 +47,12 @@ async def main():
 
         except KeyboardInterrupt:
             print("\n\nExiting Python and closing PLC connection...\n\n\n")
-            sanitrend_cloud_lite.plc.Close()
             run_code = False
             
         except Exception as error:
             print(f'Critical Error: {error} Restarting Code in 30 Seconds...')
             stc_lite.SaniTrendLogging.logger.error(repr(error))
-            asyncio.sleep(30)
+            await asyncio.sleep(30)
             
 
 if __name__ == "__main__":
@@ -1,17 +1,57 @@
 import asyncio
 import aiohttp
+from concurrent.futures import ThreadPoolExecutor
+from array import array
 from dataclasses import dataclass, field
+from functools import partial
+import hashlib
+from heapq import heappop, heappush
 import json
 import logging
 from logging import handlers
 from math import isinf
 import os
 import platform
+import random
+import shutil
 from pylogix import PLC, lgx_response
 import sqlite3
 import time
-
-
+import zlib
+
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+TWX_BASE_URL = 'http://localhost:8000'
+TWX_CONNECTION_LIMIT = 4
+WATCHDOG_TAGS = ['PLC_Watchdog', 'SaniTrend_Watchdog']
+PLC_CONNECTION_ERRORS = ('Connection failure', 'Register session failed', 'Forward open failed')
+
+
+SQL_CREATE_TAGS = ''' CREATE TABLE if not exists sanitrend_tags (TagId integer PRIMARY KEY, Name text, BaseType text, UNIQUE (Name, BaseType)) '''
+SQL_CREATE_TABLE = ''' CREATE TABLE if not exists sanitrend_backlog (FirstTime integer, RowCount integer, Bytes integer, Data blob) '''
+SQL_SELECT_TAGS = '''select TagId,Name,BaseType from sanitrend_tags'''
+SQL_INSERT_TAG = ''' INSERT INTO sanitrend_tags (Name, BaseType) VALUES (?,?); '''
+SQL_INSERT = ''' INSERT INTO sanitrend_backlog (FirstTime, RowCount, Bytes, Data) VALUES (?,?,?,?); '''
+SQL_SELECT_SIZES = '''select ROWID,Bytes from sanitrend_backlog where ROWID > ? ORDER BY ROWID LIMIT ?'''
+SQL_CREATE_QUARANTINE = ''' CREATE TABLE if not exists sanitrend_quarantine (FirstTime integer, RowCount integer, Bytes integer, Data blob) '''
+SQL_QUARANTINE = ''' INSERT INTO sanitrend_quarantine SELECT FirstTime,RowCount,Bytes,Data from sanitrend_backlog where ROWID = ? '''
+SQL_SELECT_DATA = '''select ROWID,FirstTime,Data from sanitrend_backlog where ROWID BETWEEN ? AND ? ORDER BY ROWID'''
+SQL_SELECT_ROWS = 512
+SQL_SELECT_ANY = '''select 1 from sanitrend_backlog LIMIT 1'''
+SQL_DELETE_RANGE = ''' DELETE FROM sanitrend_backlog where ROWID BETWEEN ? AND ? '''
+SQL_SELECT_TOTALS = '''select count(*),coalesce(sum(RowCount),0),coalesce(sum(length(Data)),0) from sanitrend_backlog'''
+SQL_SELECT_RANGE_TOTALS = '''select count(*),coalesce(sum(RowCount),0),coalesce(sum(length(Data)),0) from sanitrend_backlog where ROWID BETWEEN ? AND ?'''
+SQL_SELECT_OLDEST = '''select ROWID,FirstTime,RowCount,Data from sanitrend_backlog ORDER BY ROWID LIMIT ?'''
+SQL_SELECT_OLDEST_TIMES = '''select ROWID,FirstTime,RowCount from sanitrend_backlog ORDER BY ROWID LIMIT ?'''
+SQL_UPDATE_BATCH = ''' UPDATE sanitrend_backlog SET FirstTime = ?, RowCount = ?, Bytes = ?, Data = ? where ROWID = ? '''
+SQL_LEGACY_EXISTS = '''select 1 from sqlite_master where type = 'table' and name = 'sanitrend' '''
+SQL_LEGACY_SELECT = '''select TwxData from sanitrend where SentToTwx = false ORDER BY ROWID'''
+SQL_LEGACY_DROP = ''' DROP TABLE sanitrend '''
 
 
 class SaniTrendLogging:
@@ -28,79 +68,417 @@ class SaniTrendLogging:
 
 @dataclass
 class SaniTrendDatabase:
-    """Class for dealing with Sqlite3 database
+    """Class for dealing with Sqlite3 database\n
+    Thingworx data that could not be uploaded is queued here until it can be sent. One connection
+    is held open for the life of the service in WAL mode with synchronous=NORMAL, so queueing data
+    during a long Thingworx outage does not pay for a connect, schema check and full fsync every time.
+    The SQL statements are module constants so the sqlite3 statement cache reuses the prepared statements.\n
+    Each queued upload is stored as one zlib compressed batch of columns (tag id, time offset, value).
+    Tag names and base types are kept once in the sanitrend_tags table, and the quality is only stored
+    when a row is not 'GOOD'.\n
+    The backlog is capped at limit_bytes of compressed data, limit_rows Thingworx rows and limit_age
+    seconds (0 disables a limit). Batches older than limit_age are dropped. Over the size or row limit
+    the oldest batches are dropped, or with downsample set they are thinned to every other sample of
+    each tag first and only dropped once they hold a single sample per tag. The database uses
+    incremental auto vacuum, so space freed by uploaded and dropped batches is returned to the disk.
     """
+    database: str = 'stc.db'
+    limit_bytes: int = 0
+    limit_rows: int = 0
+    limit_age: float = 0
+    downsample: bool = False
+    connection: sqlite3.Connection = field(init = False, default = None, repr = False)
+    tag_ids: dict = field(init = False, default_factory = dict, repr = False)
+    tag_names: dict = field(init = False, default_factory = dict, repr = False)
+    queued_batches: int = field(init = False, default = 0)
+    queued_rows: int = field(init = False, default = 0)
+    queued_bytes: int = field(init = False, default = 0)
+    dropped_rows: int = field(init = False, default = 0)
+    quarantined_batches: int = field(init = False, default = 0)
+
+
+    def __post_init__(self) -> None:
+        self.connection = sqlite3.connect(database = self.database, check_same_thread = False)
+        if self.connection.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            self.enable_incremental_vacuum()
+
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute(SQL_CREATE_TAGS)
+            self.connection.execute(SQL_CREATE_TABLE)
+            self.connection.execute(SQL_CREATE_QUARANTINE)
+
+        self._load_tags()
+        self.migrate_legacy_data()
+        self._load_totals()
+
+
+    def enable_incremental_vacuum(self) -> bool:
+        """Switches the database to incremental auto_vacuum.\n
+        auto_vacuum can only be changed on an existing database by rebuilding it once with VACUUM, which
+        needs about twice the database size in free disk. When there is not enough free space, or the
+        rebuild fails, the database is left as it is and runs without incremental vacuum.
+
+        Returns:
+            bool: True if incremental auto_vacuum is enabled
+        """
+        try:
+            db_bytes = self.file_bytes()
+            if db_bytes > 0:
+                free_bytes = shutil.disk_usage(os.path.dirname(os.path.abspath(self.database))).free
+                if free_bytes < 2 * db_bytes:
+                    SaniTrendLogging.logger.warning(f'Not enough free disk to rebuild {self.database} for incremental vacuum')
+                    return False
+
+            self.connection.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            self.connection.execute('VACUUM')
+            return True
+
+        except Exception as e:
+            SaniTrendLogging.logger.error(repr(e))
+            return False
+
+
+    def _load_tags(self) -> None:
+        self.tag_ids.clear()
+        self.tag_names.clear()
+        for tag_id, name, base_type in self.connection.execute(SQL_SELECT_TAGS):
+            self.tag_ids[(name, base_type)] = tag_id
+            self.tag_names[tag_id] = (name, base_type)
+
+
+    def _load_totals(self) -> None:
+        self.queued_batches, self.queued_rows, self.queued_bytes = self.connection.execute(SQL_SELECT_TOTALS).fetchone()
+
+
+    def migrate_legacy_data(self) -> None:
+        """Moves data queued in the old JSON text table into the compressed backlog and drops the old table
+        """
+        try:
+            if self.connection.execute(SQL_LEGACY_EXISTS).fetchone() is None:
+                return None
+
+            with self.connection:
+                for (twx_data,) in self.connection.execute(SQL_LEGACY_SELECT).fetchall():
+                    self._insert(json.loads(twx_data))
+
+                self.connection.execute(SQL_LEGACY_DROP)
+
+        except Exception as e:
+            SaniTrendLogging.logger.error(repr(e))
+            self._load_tags()
+
+
+    def close(self) -> None:
+        """Closes the database connection
+        """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+    def _tag_id(self, name: str, base_type: str) -> int:
+        key = (name, base_type)
+        tag_id = self.tag_ids.get(key)
+        if tag_id is None:
+            tag_id = self.connection.execute(SQL_INSERT_TAG, key).lastrowid
+            self.tag_ids[key] = tag_id
+            self.tag_names[tag_id] = key
+
+        return tag_id
+
+
+    def _encode(self, data: list) -> tuple:
+        first_time = min(row['time'] for row in data)
+        tag_ids = []
+        times = []
+        values = []
+        qualities = []
+        for row in data:
+            tag_ids.append(self._tag_id(row['name'], row['value']['baseType']))
+            times.append(row['time'] - first_time)
+            values.append(row['value']['value'])
+            qualities.append(row['quality'])
+
+        batch = {'tag': tag_ids, 'time': times, 'value': values}
+        if any(quality != 'GOOD' for quality in qualities):
+            batch['quality'] = qualities
+
+        return first_time, zlib.compress(encode_json(batch))
+
+
+    def _insert(self, data: list) -> None:
+        first_time, blob = self._encode(data)
+        self.connection.execute(SQL_INSERT, (first_time, len(data), len(encode_json(data)), blob))
+        self.queued_batches += 1
+        self.queued_rows += len(data)
+        self.queued_bytes += len(blob)
+
+
+    def _delete_range(self, first_id: int, last_id: int) -> None:
+        batches, rows, data_bytes = self.connection.execute(SQL_SELECT_RANGE_TOTALS, (first_id, last_id)).fetchone()
+        self.connection.execute(SQL_DELETE_RANGE, (first_id, last_id))
+        self.queued_batches -= batches
+        self.queued_rows -= rows
+        self.queued_bytes -= data_bytes
+
+
+    def _rows(self, blob: bytes, first_time: int) -> list:
+        batch = decode_json(zlib.decompress(blob))
+        qualities = batch.get('quality')
+        rows = []
+        for i, tag_id in enumerate(batch['tag']):
+            name, base_type = self.tag_names[tag_id]
+            rows.append({
+                'time': first_time + batch['time'][i],
+                'quality': qualities[i] if qualities is not None else 'GOOD',
+                'name': name,
+                'value': {
+                    'value': batch['value'][i],
+                    'baseType': base_type
+                }
+            })
+
+        return rows
 
 
-    def log_twx_data_to_db(data: list, dbase: str) -> bool:
+    def log_twx_data_to_db(self, data: list) -> bool:
         """Logs Thingworx data to SQLite3 database.
 
         Args:
             data (list): List of Thingworx data with proper formatting.
-            dbase (str): Name of database
 
         Returns:
             bool: True if database operation was successful, else False
         """
         if data:
             try:
-                with sqlite3.connect(database = dbase) as db:
-                    cur = db.cursor()
-                    cur.execute(''' CREATE TABLE if not exists sanitrend (TwxData text, SentToTwx integer) ''')   
-                    records = []     
-                    sql_as_text = ''
-                    insert_query = ''' INSERT INTO sanitrend (TwxData, SentToTwx) VALUES (?,?); '''
-                    sql_as_text = json.dumps(data)
-                    records.append((sql_as_text, False)) 
-                    cur.executemany(insert_query, records)
-                    db.commit()
-                    return True
+                with self.connection:
+                    self._insert(data)
+                    self.enforce_limits()
+                return True
             
             except Exception as e:
                 SaniTrendLogging.logger.error(repr(e))
+                self._load_tags()
+                self._load_totals()
                 return False
 
         else:
             return False
 
-    async def upload_twx_data_from_db(dbase: str, url: str) -> int:
-        """Queries SQLite database for Thingworx data that needs to be uploaded and uploads it.
+
+    def has_twx_data(self) -> bool:
+        """Checks the database for Thingworx data waiting to be uploaded
+
+        Returns:
+            bool: True if there is queued data
+        """
+        try:
+            return self.connection.execute(SQL_SELECT_ANY).fetchone() is not None
+
+        except Exception as e:
+            SaniTrendLogging.logger.error(repr(e))
+            return False
+
+
+    def read_twx_batch(self, after_id: int = 0, max_bytes: int = 262144) -> tuple:
+        """Reads the oldest queued Thingworx data after a ROWID.\n
+        Rows are taken oldest first until the batch reaches max_bytes of uncompressed Thingworx data
+        (always at least one row), and only the rows taken are decompressed.
 
         Args:
-            dbase (str): name of database file
-            url (str): url of Thingworx "Thing" UpdatePropertyValues service.
+            after_id (int, optional): only rows with a higher ROWID are read. Defaults to 0.
+            max_bytes (int, optional): size limit of the batch. Defaults to 262144.
+
+        A row that cannot be decoded is moved to the quarantine table so it does not block the rest of the backlog.
 
         Returns:
-            int: http response from REST call to Thingworx
+            tuple: first ROWID, last ROWID and list of Thingworx data, ROWIDs are None if there is nothing queued.
+            None if the database could not be read.
         """
-        select_query = '''select ROWID,TwxData,SentToTwx from sanitrend where SentToTwx = false LIMIT 32'''
-        delete_ids = []
-        sql_twx_data = []
         try:
-            with sqlite3.connect(database = dbase) as db:
-                cur = db.cursor()  
-                cur.execute(''' CREATE TABLE if not exists sanitrend (TwxData text, SentToTwx integer) ''')
-                cur.execute(select_query)  
-                records = cur.fetchall()
-                for row in records:
-                    delete_ids.append(row[0])
-                    sql_data = json.loads(row[1])
-                    for item in sql_data:
-                        sql_twx_data.append(item)
-                
-                if len(sql_twx_data) > 0:
-                    response = await twx_request('update_tag_values', url, 'status', sql_twx_data)
-                    if response == 200:
-                        delete_query = ''' DELETE FROM sanitrend where ROWID=? '''
-                        for id in delete_ids:
-                            cur.execute(delete_query, (id,))
-                        db.commit()
-                
-                    return response
-            
+            while True:
+                sql_twx_data = []
+                batch_bytes = 0
+                first_id = None
+                last_id = None
+                records = self.connection.execute(SQL_SELECT_SIZES, (after_id, SQL_SELECT_ROWS)).fetchall()
+                for row_id, row_bytes in records:
+                    if first_id is not None and batch_bytes + row_bytes > max_bytes:
+                        break
+
+                    batch_bytes += row_bytes
+                    if first_id is None:
+                        first_id = row_id
+                    last_id = row_id
+
+                if first_id is None:
+                    return None, None, []
+
+                bad_id = None
+                for row_id, first_time, blob in self.connection.execute(SQL_SELECT_DATA, (first_id, last_id)).fetchall():
+                    try:
+                        sql_twx_data.extend(self._rows(blob, first_time))
+
+                    except Exception as e:
+                        SaniTrendLogging.logger.error(f'Quarantining backlog row {row_id}: {e!r}')
+                        bad_id = row_id
+                        break
+
+                if bad_id is None:
+                    return first_id, last_id, sql_twx_data
+
+                self.quarantine_twx_data(bad_id)
+
         except Exception as e:
             SaniTrendLogging.logger.error(repr(e))
-            return 404
+            return None
+
+
+    def quarantine_twx_data(self, row_id: int) -> None:
+        """Moves a queued row that cannot be decoded out of the backlog
+
+        Args:
+            row_id (int): ROWID of the row
+        """
+        with self.connection:
+            self._quarantine(row_id)
+
+
+    def _quarantine(self, row_id: int) -> None:
+        self.connection.execute(SQL_QUARANTINE, (row_id,))
+        self._delete_range(row_id, row_id)
+        self.quarantined_batches += 1
+
+
+    def delete_twx_data(self, first_id: int, last_id: int) -> bool:
+        """Deletes uploaded Thingworx data as one ROWID range
+
+        Args:
+            first_id (int): first ROWID of range
+            last_id (int): last ROWID of range
+
+        Returns:
+            bool: True if database operation was successful, else False
+        """
+        try:
+            with self.connection:
+                self._delete_range(first_id, last_id)
+            return True
+
+        except Exception as e:
+            SaniTrendLogging.logger.error(repr(e))
+            self._load_totals()
+            return False
+
+
+    def over_limits(self) -> bool:
+        """Checks whether the backlog is over its size or row limit
+
+        Returns:
+            bool: True if batches need to be dropped or downsampled
+        """
+        if self.limit_bytes > 0 and self.queued_bytes > self.limit_bytes:
+            return True
+
+        return self.limit_rows > 0 and self.queued_rows > self.limit_rows
+
+
+    def enforce_limits(self) -> None:
+        """Drops or downsamples the oldest batches until the backlog is within its limits.\n
+        Runs inside the caller's transaction.
+        """
+        if self.limit_age > 0:
+            cutoff = int(round((time.time() - self.limit_age) * 1000))
+            while self.queued_batches > 0:
+                oldest = self.connection.execute(SQL_SELECT_OLDEST_TIMES, (SQL_SELECT_ROWS,)).fetchall()
+                # only the leading run of expired batches, a ROWID range must not take newer batches with it
+                expired = []
+                for row in oldest:
+                    if row[1] >= cutoff:
+                        break
+                    expired.append(row)
+
+                if not expired:
+                    break
+
+                self.dropped_rows += sum(row[2] for row in expired)
+                self._delete_range(expired[0][0], expired[-1][0])
+                if len(expired) < len(oldest):
+                    break
+
+        while self.queued_batches > 1 and self.over_limits():
+            for row_id, first_time, row_count, blob in self.connection.execute(SQL_SELECT_OLDEST, (SQL_SELECT_ROWS,)).fetchall():
+                if not self.over_limits() or self.queued_batches <= 1:
+                    break
+
+                if self.downsample:
+                    try:
+                        rows = self._rows(blob, first_time)
+
+                    except Exception as e:
+                        SaniTrendLogging.logger.error(f'Quarantining backlog row {row_id}: {e!r}')
+                        self._quarantine(row_id)
+                        continue
+
+                    kept = downsample_rows(rows)
+                    if len(kept) < len(rows):
+                        new_time, new_blob = self._encode(kept)
+                        self.connection.execute(SQL_UPDATE_BATCH, (new_time, len(kept), len(encode_json(kept)), new_blob, row_id))
+                        self.dropped_rows += len(rows) - len(kept)
+                        self.queued_rows -= len(rows) - len(kept)
+                        self.queued_bytes += len(new_blob) - len(blob)
+                        continue
+
+                self.dropped_rows += row_count
+                self._delete_range(row_id, row_id)
+
+
+    def incremental_vacuum(self, pages: int = 256) -> None:
+        """Returns up to pages free database pages to the disk
+
+        Args:
+            pages (int, optional): most pages to free. Defaults to 256.
+        """
+        try:
+            # execute() only steps the pragma once, which frees a single page
+            self.connection.executescript(f'PRAGMA incremental_vacuum({int(pages)})')
+
+        except Exception as e:
+            SaniTrendLogging.logger.error(repr(e))
+
+
+    def oldest_time(self) -> int:
+        """Time of the oldest queued row
+
+        Returns:
+            int: milliseconds since the epoch, or None if nothing is queued
+        """
+        try:
+            row = self.connection.execute(SQL_SELECT_OLDEST_TIMES, (1,)).fetchone()
+            return row[1] if row is not None else None
+
+        except Exception as e:
+            SaniTrendLogging.logger.error(repr(e))
+            return None
+
+
+    def file_bytes(self) -> int:
+        """Size of the database file
+
+        Returns:
+            int: page count times page size, in bytes
+        """
+        try:
+            page_count = self.connection.execute('PRAGMA page_count').fetchone()[0]
+            page_size = self.connection.execute('PRAGMA page_size').fetchone()[0]
+            return page_count * page_size
+
+        except Exception as e:
+            SaniTrendLogging.logger.error(repr(e))
+            return 0
 
 
 
@@ -114,9 +492,655 @@ class SimpleTimer:
     timestamp: int = field(init=False)
 
 
-    def __post_init__(self):
-        self.timestamp = int(round(time.time() * 1000))
-        self.done = True if (self.timestamp - self.compare_time) >= self.preset else False
+    def __post_init__(self):
+        self.timestamp = int(round(time.time() * 1000))
+        self.done = True if (self.timestamp - self.compare_time) >= self.preset else False
+
+
+
+
+@dataclass
+class ScanScheduler:
+    '''Fixed rate scheduler that wakes at each scan deadline.\n
+    Deadlines are kept on time.monotonic(), so wall clock adjustments do not move them and the
+    sleep time is recalculated every scan, so it does not drift. When a cycle runs past one or more
+    whole periods, the missed scans are skipped rather than run back to back.'''
+    period: float
+    next_deadline: float = None
+    overruns: int = 0
+    skipped: int = 0
+
+
+    async def wait(self) -> None:
+        """Sleeps until the next scan deadline, returning immediately on the first call or if the deadline has already passed
+        """
+        if self.next_deadline is None:
+            self.next_deadline = time.monotonic() + self.period
+            return None
+
+        late = time.monotonic() - self.next_deadline
+        if late < 0:
+            await asyncio.sleep(-late)
+
+        elif late > 0:
+            self.overruns += 1
+            missed = int(late // self.period)
+            if missed:
+                self.skipped += missed
+                self.next_deadline += missed * self.period
+
+        self.next_deadline += self.period
+
+
+
+
+@dataclass
+class ConnectionHealth:
+    '''Health of a connection as UP, DEGRADED or DOWN, with exponential backoff between checks.\n
+    A success makes the connection UP and schedules the next check interval seconds later. A failure
+    makes it DEGRADED, or DOWN once down_after failures in a row have been seen (or straight away
+    for a definite failure), and the next check is backed off from backoff_min doubling up to
+    backoff_max seconds, with jitter so that many devices do not retry in step.'''
+    name: str = 'connection'
+    interval: float = 10
+    backoff_min: float = 1
+    backoff_max: float = 300
+    down_after: int = 3
+    state: str = 'DOWN'
+    failures: int = 0
+    next_check: float = 0
+    transitions: dict = field(default_factory = dict)
+
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            transition = f'{self.state}->{state}'
+            self.transitions[transition] = self.transitions.get(transition, 0) + 1
+            SaniTrendLogging.logger.info(f'{self.name} {transition}')
+            self.state = state
+
+
+    def check_due(self) -> bool:
+        """Checks whether the connection should be checked again
+
+        Returns:
+            bool: True once the interval or backoff since the last result has passed
+        """
+        return time.monotonic() >= self.next_check
+
+
+    def backoff(self) -> float:
+        """Delay before the next check after the current run of failures
+
+        Returns:
+            float: seconds
+        """
+        delay = min(self.backoff_max, self.backoff_min * 2 ** max(0, self.failures - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+    def success(self) -> None:
+        """Records a successful check or request
+        """
+        self.failures = 0
+        self._set_state('UP')
+        self.next_check = time.monotonic() + self.interval
+
+
+    def failure(self, definite: bool = False) -> None:
+        """Records a failed check or request
+
+        Args:
+            definite (bool, optional): the failure proves the connection is down. Defaults to False.
+        """
+        self.failures += 1
+        if definite or self.failures >= self.down_after:
+            self._set_state('DOWN')
+
+        else:
+            self._set_state('DEGRADED')
+
+        self.next_check = time.monotonic() + self.backoff()
+
+
+
+
+@dataclass
+class SampleClock:
+    '''Wall clock for timestamping PLC samples.\n
+    time.time() is read once as an anchor and samples are stamped with the anchor plus the time.monotonic()
+    time since, so wall clock steps between resyncs do not move sample times. The anchor is refreshed every
+    resync_interval seconds to follow NTP corrections, and stamps never go backwards across a resync.'''
+    resync_interval: float = 60
+    wall_anchor: float = field(init = False, repr = False)
+    monotonic_anchor: float = field(init = False, repr = False)
+    last_timestamp: int = field(init = False, default = 0, repr = False)
+
+
+    def __post_init__(self) -> None:
+        self.resync()
+
+
+    def resync(self) -> None:
+        """Re-anchors the clock to the current wall clock time
+        """
+        self.wall_anchor = time.time()
+        self.monotonic_anchor = time.monotonic()
+
+
+    def now(self) -> int:
+        """Current time
+
+        Returns:
+            int: milliseconds since the epoch
+        """
+        elapsed = time.monotonic() - self.monotonic_anchor
+        if elapsed >= self.resync_interval:
+            self.resync()
+            elapsed = 0
+
+        timestamp = int(round((self.wall_anchor + elapsed) * 1000))
+        if timestamp < self.last_timestamp:
+            timestamp = self.last_timestamp
+
+        self.last_timestamp = timestamp
+        return timestamp
+
+
+
+
+@dataclass
+class TaskSupervisor:
+    '''Runs jobs as tracked asyncio tasks with at most one in-flight instance of each job.\n
+    When a job is started while its previous run is still going, the new run is dropped and counted
+    instead of piling up another task.'''
+    tasks: dict = field(default_factory = dict)
+    dropped: dict = field(default_factory = dict)
+
+
+    def spawn(self, name: str, function, *args) -> bool:
+        """Starts a job unless the previous run of it is still in flight
+
+        Args:
+            name (str): name of job
+            function (coroutine function): job to run
+            *args: arguments for function
+
+        Returns:
+            bool: True if the job was started, False if it was dropped
+        """
+        task = self.tasks.get(name)
+        if task is not None and not task.done():
+            self.dropped[name] = self.dropped.get(name, 0) + 1
+            return False
+
+        self.tasks[name] = asyncio.create_task(self._run(name, function, *args), name = name)
+        return True
+
+
+    async def _run(self, name: str, function, *args) -> None:
+        try:
+            await function(*args)
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception as e:
+            SaniTrendLogging.logger.error(f'{name}: {e!r}')
+
+
+    def in_flight(self) -> int:
+        """Number of jobs currently running
+
+        Returns:
+            int: running job count
+        """
+        return sum(1 for task in self.tasks.values() if not task.done())
+
+
+    async def cancel_all(self) -> None:
+        """Cancels all running jobs and waits for them to finish
+        """
+        tasks = [task for task in self.tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions = True)
+        self.tasks.clear()
+
+
+
+
+@dataclass
+class PriorityGate:
+    '''Lock that is handed to waiters by priority (lower first), then in arrival order.\n
+    Used to let the watchdog handshake go ahead of bulk PLC reads and writes that are already waiting.'''
+    busy: bool = False
+    waiters: list = field(default_factory = list, repr = False)
+    sequence: int = 0
+
+
+    async def acquire(self, priority: int = 1) -> None:
+        """Waits for the gate
+
+        Args:
+            priority (int, optional): waiters with a lower number go first. Defaults to 1.
+        """
+        if not self.busy and not self.waiters:
+            self.busy = True
+            return None
+
+        future = asyncio.get_running_loop().create_future()
+        heappush(self.waiters, (priority, self.sequence, future))
+        self.sequence += 1
+        try:
+            await future
+
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the gate was handed over as this waiter was cancelled, pass it on
+                self.release()
+            raise
+
+
+    def release(self) -> None:
+        """Hands the gate to the next waiter, or frees it if nobody is waiting
+        """
+        while self.waiters:
+            future = heappop(self.waiters)[2]
+            if not future.done():
+                future.set_result(None)
+                return None
+
+        self.busy = False
+
+
+
+
+@dataclass
+class PlcWriteQueue:
+    '''Pending PLC tag writes, coalesced by tag name.\n
+    A write to a tag that is already waiting replaces its value (last value wins) and every caller
+    of the tag gets the status of the value that was finally written. The writes waiting when the
+    writer takes them are sent to the PLC together.'''
+    pending: dict = field(default_factory = dict)
+    event: asyncio.Event = field(default_factory = asyncio.Event, repr = False)
+    coalesced: int = 0
+
+
+    def put(self, tag_name: str, value: any) -> asyncio.Future:
+        """Queues a write
+
+        Args:
+            tag_name (str): name of tag in PLC
+            value (any): value to write
+
+        Returns:
+            asyncio.Future: resolves to the lgx_response of the write, or None if the write could not be sent
+        """
+        future = asyncio.get_running_loop().create_future()
+        entry = self.pending.get(tag_name)
+        if entry is None:
+            self.pending[tag_name] = (value, [future])
+
+        else:
+            self.coalesced += 1
+            self.pending[tag_name] = (value, entry[1] + [future])
+
+        self.event.set()
+        return future
+
+
+    async def take(self) -> dict:
+        """Waits for writes and takes all of them off the queue
+
+        Returns:
+            dict: tag name to (value, futures of the callers)
+        """
+        await self.event.wait()
+        self.event.clear()
+        pending = self.pending
+        self.pending = {}
+        return pending
+
+
+    def cancel_all(self) -> None:
+        """Resolves every waiting write as not sent
+        """
+        for value, futures in self.pending.values():
+            for future in futures:
+                if not future.done():
+                    future.set_result(None)
+
+        self.pending.clear()
+
+
+
+
+@dataclass(slots = True)
+class Deadband:
+    '''Change filter for an analog tag.\n
+    A new value is only accepted once it differs from the last accepted value by the deadband, either
+    an absolute amount or a percent of the engineering unit span (EUMin to EUMax from Thingworx).
+    Until the span is known a percent deadband uses the absolute fallback amount instead. When max_age seconds pass without an accepted value, the current value is accepted anyway, so
+    slow changing signals are still published.'''
+    amount: float = 0.25
+    percent: bool = False
+    max_age: float = 0
+    fallback: float = 0.25
+    eu_min: float = None
+    eu_max: float = None
+
+
+    def threshold(self) -> float:
+        """Deadband in engineering units
+
+        Returns:
+            float: smallest change that is accepted
+        """
+        if self.percent:
+            if self.eu_min is None or self.eu_max is None or self.eu_max == self.eu_min:
+                return self.fallback
+
+            return abs(self.eu_max - self.eu_min) * self.amount / 100
+
+        return self.amount
+
+
+    def passes(self, old_value: float, new_value: float) -> bool:
+        """Checks whether a new value is outside the deadband of the last accepted value
+
+        Args:
+            old_value (float): last accepted value
+            new_value (float): value read from the PLC
+
+        Returns:
+            bool: True if the new value should be accepted
+        """
+        change = abs(new_value - old_value)
+        return change > 0 and change >= self.threshold()
+
+
+    def expired(self, last_time: int, now: int) -> bool:
+        """Checks whether the last accepted value is older than max_age
+
+        Args:
+            last_time (int): time of last accepted value in milliseconds
+            now (int): current time in milliseconds
+
+        Returns:
+            bool: True if a value should be published regardless of the deadband
+        """
+        return self.max_age > 0 and now - last_time >= self.max_age * 1000
+
+
+
+
+@dataclass(slots = True)
+class SwingingDoor:
+    '''Swinging door trending compression for a numeric tag.\n
+    Starting at the last published point, two doors pivot deviation above and below it and swing open
+    as samples arrive. While every sample since the last published point fits between the doors,
+    a straight line from that point reconstructs them within deviation and nothing is published.
+    When the doors open past parallel, the point on the trend line at the previous sample's time is
+    published and becomes the new pivot.'''
+    deviation: float
+    archived: tuple = None
+    held: tuple = None
+    slope_upper: float = float('-inf')
+    slope_lower: float = float('inf')
+
+
+    def reset(self, timestamp: int, value: float) -> None:
+        """Restarts compression from a point that was published
+
+        Args:
+            timestamp (int): time of point in milliseconds
+            value (float): value of point
+        """
+        self.archived = (timestamp, value)
+        self.held = None
+        self.slope_upper = float('-inf')
+        self.slope_lower = float('inf')
+
+
+    def add(self, timestamp: int, value: float) -> tuple:
+        """Adds a sample to the trend
+
+        Args:
+            timestamp (int): time of sample in milliseconds
+            value (float): value of sample
+
+        Returns:
+            tuple: (timestamp, value) of the point to publish, or None if nothing needs publishing
+        """
+        if self.archived is None:
+            self.reset(timestamp, value)
+            return self.archived
+
+        archived_time, archived_value = self.archived
+        if timestamp <= (self.held or self.archived)[0]:
+            return None
+
+        elapsed = timestamp - archived_time
+        slope_upper = max(self.slope_upper, (value - archived_value - self.deviation) / elapsed)
+        slope_lower = min(self.slope_lower, (value - archived_value + self.deviation) / elapsed)
+        if slope_upper <= slope_lower or self.held is None:
+            self.slope_upper = slope_upper
+            self.slope_lower = slope_lower
+            self.held = (timestamp, value)
+            return None
+
+        # the doors opened, publish the end of a line through the doors at the previous sample,
+        # which keeps every sample since the last published point within deviation of the trend
+        held_time = self.held[0]
+        slope = (self.slope_upper + self.slope_lower) / 2
+        emit = (held_time, archived_value + slope * (held_time - archived_time))
+        self.reset(*emit)
+        elapsed = timestamp - held_time
+        self.slope_upper = (value - emit[1] - self.deviation) / elapsed
+        self.slope_lower = (value - emit[1] + self.deviation) / elapsed
+        self.held = (timestamp, value)
+        return emit
+
+
+    def flush(self) -> tuple:
+        """Gets the point on the trend line at the held sample, for publishing before the doors are restarted
+
+        Returns:
+            tuple: (timestamp, value) of the point to publish, or None if no sample is held
+        """
+        if self.archived is None or self.held is None:
+            return None
+
+        archived_time, archived_value = self.archived
+        held_time = self.held[0]
+        slope = (self.slope_upper + self.slope_lower) / 2
+        return (held_time, archived_value + slope * (held_time - archived_time))
+
+
+
+
+@dataclass(slots = True)
+class SampleBuffer:
+    '''Fixed size ring buffer of the samples of a tag accepted since the last upload.\n
+    Times are kept in a preallocated array and values in a preallocated list, so memory stays bounded
+    no matter how long uploads are held up. When the buffer is full either the oldest sample is
+    overwritten (drop_oldest) or the new sample is discarded, and the discarded samples are counted.'''
+    capacity: int = 60
+    drop_oldest: bool = True
+    times: array = field(init = False, repr = False)
+    values: list = field(init = False, repr = False)
+    start: int = 0
+    count: int = 0
+    dropped: int = 0
+
+
+    def __post_init__(self) -> None:
+        self.capacity = max(1, self.capacity)
+        self.times = array('q', bytes(8 * self.capacity))
+        self.values = [None] * self.capacity
+
+
+    def __len__(self) -> int:
+        return self.count
+
+
+    def append(self, timestamp: int, value: any) -> bool:
+        """Adds a sample
+
+        Args:
+            timestamp (int): time of sample in milliseconds
+            value (any): value of sample
+
+        Returns:
+            bool: True if the sample was stored, False if it was discarded
+        """
+        if self.count == self.capacity:
+            self.dropped += 1
+            if not self.drop_oldest:
+                return False
+
+            self.start = (self.start + 1) % self.capacity
+            self.count -= 1
+
+        index = (self.start + self.count) % self.capacity
+        self.times[index] = timestamp
+        self.values[index] = value
+        self.count += 1
+        return True
+
+
+    def drain(self) -> list:
+        """Gets the buffered samples oldest first and empties the buffer
+
+        Returns:
+            list: (timestamp, value) of each sample
+        """
+        samples = []
+        for i in range(self.count):
+            index = (self.start + i) % self.capacity
+            samples.append((self.times[index], self.values[index]))
+            self.values[index] = None
+
+        self.start = 0
+        self.count = 0
+        return samples
+
+
+
+
+@dataclass(slots = True)
+class TagRecord:
+    '''Latest state of a single PLC tag'''
+    tag_name: str
+    value: any = None
+    status: str = ''
+    timestamp: int = 0
+    compressor: SwingingDoor = None
+    samples: SampleBuffer = None
+
+
+
+
+@dataclass(slots = True)
+class TwxTagConfig:
+    '''Thingworx property settings for a PLC tag'''
+    twx_name: str
+    base_type: str
+    ignore: bool = False
+    deadband: Deadband = field(default_factory = Deadband)
+    compression: float = 0
+    buffer_size: int = 60
+    buffer_drop_oldest: bool = True
+
+
+
+
+@dataclass
+class TagStore:
+    """PLC tag state keyed by normalized (lower case) tag name
+    """
+    tags: dict = field(default_factory = dict)
+    dirty: set = field(default_factory = set)
+
+
+    def __iter__(self):
+        return iter(self.tags.values())
+
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+
+    @staticmethod
+    def normalize(tag_name: str) -> str:
+        return tag_name.lower()
+
+
+    def get(self, tag_name: str) -> TagRecord:
+        """Gets the record for a tag
+
+        Args:
+            tag_name (str): tag name, not case sensitive
+
+        Returns:
+            TagRecord: record of tag, or None if the tag has not been read yet
+        """
+        return self.tags.get(self.normalize(tag_name))
+
+
+    def add(self, tag_name: str) -> TagRecord:
+        """Gets the record for a tag, creating it if the tag has not been read yet
+
+        Args:
+            tag_name (str): tag name, not case sensitive
+
+        Returns:
+            TagRecord: record of tag
+        """
+        key = self.normalize(tag_name)
+        record = self.tags.get(key)
+        if record is None:
+            record = TagRecord(tag_name)
+            self.tags[key] = record
+        return record
+
+
+    def mark_dirty(self, record: TagRecord) -> None:
+        """Flags a tag as changed since the last Thingworx upload and buffers its current value and time
+
+        Args:
+            record (TagRecord): record of tag
+        """
+        if record.samples is not None:
+            record.samples.append(record.timestamp, record.value)
+
+        self.dirty.add(self.normalize(record.tag_name))
+
+
+    def pop_dirty(self) -> list:
+        """Gets the tags changed since the last call and clears the changed flags
+
+        Returns:
+            list: TagRecord of each changed tag
+        """
+        records = [self.tags[key] for key in self.dirty]
+        self.dirty.clear()
+        return records
+
+
+    def value(self, tag_name: str) -> any:
+        """Gets the current value of a tag
+
+        Args:
+            tag_name (str): tag name, not case sensitive
+
+        Returns:
+            any: value of tag, or None if the tag has not been read yet
+        """
+        record = self.get(tag_name)
+        return record.value if record is not None else None
 
 
 
@@ -131,85 +1155,333 @@ class STC:
     config_file: str = 'SaniTrendConfig.json'
     smi_number: str = ''
     plc = PLC()
-    plc_data: list = field(default_factory = list)
-    plc_data_buffer: list = field(default_factory = list)
+    plc_data: TagStore = field(default_factory = TagStore)
     plc_tag_list: list = field(default_factory = list)
     plc_tag_delta: float = 0.25
     plc_ip_address: str = ''
     plc_scan_rate: int = 1000
-    plc_last_scan_time: int = 0
+    plc_scheduler: ScanScheduler = field(init = False, repr = False)
+    plc_scan_latency: float = 0
+    plc_scan_latency_max: float = 0
+    plc_scan_count: int = 0
+    plc_clock: SampleClock = field(default_factory = SampleClock, repr = False)
+    watchdog_rate: int = 500
+    watchdog_scheduler: ScanScheduler = field(init = False, repr = False)
+    watchdog_latency: float = 0
+    watchdog_latency_max: float = 0
+    watchdog_echoes: int = 0
+    plc_executor: ThreadPoolExecutor = field(default_factory = lambda: ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'pylogix'), repr = False)
+    plc_io_gate: PriorityGate = field(default_factory = PriorityGate, repr = False)
+    plc_health: ConnectionHealth = field(default_factory = lambda: ConnectionHealth('PLC', backoff_max = 30, down_after = 2), repr = False)
+    plc_io_short_circuited: int = 0
+    plc_io_queue_size: int = 8
+    plc_io_pending: int = 0
+    plc_io_rejected: int = 0
+    plc_io_times: tuple = (0, 0, 0)
     remote_plc_config: list = field(default_factory = list)
     remote_plc_last_config_time: int = 0
+    remote_plc_config_hash: str = ''
+    plc_config_applied: dict = field(default_factory = dict, repr = False)
+    plc_config_writes: int = 0
+    plc_write_queue: PlcWriteQueue = field(default_factory = PlcWriteQueue, repr = False)
+    plc_write_batches: int = 0
     twx_tag_table: list = field(default_factory = list)
+    twx_tag_map: dict = field(default_factory = dict)
     twx_connected: bool = False
-    twx_last_conn_test: int = 0
-    twx_conn_fail_count: int = 0
+    twx_health: ConnectionHealth = field(default_factory = lambda: ConnectionHealth('Thingworx', backoff_max = 60), repr = False)
     twx_upload_data: list = field(default_factory = list)
-    db_busy: bool = False
+    twx_session: aiohttp.ClientSession = field(default = None, repr = False)
+    twx_conn_new: int = 0
+    twx_conn_reused: int = 0
+    db_executor: ThreadPoolExecutor = field(default_factory = lambda: ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'sqlite'), repr = False)
+    db_queue: asyncio.Queue = field(default_factory = lambda: asyncio.Queue(64), repr = False)
+    db_write_batches: int = 0
+    db_write_failures: int = 0
+    backlog_batch_bytes: int = 262144
+    backlog_drain_rate: float = 2
+    backlog_concurrency: int = 2
+    backlog_in_flight: int = 0
+    backlog_event: asyncio.Event = field(default_factory = asyncio.Event, repr = False)
+    twx_live_idle: asyncio.Event = field(default_factory = asyncio.Event, repr = False)
+    supervisor: TaskSupervisor = field(default_factory = TaskSupervisor, repr = False)
+    metrics_last_log_time: int = 0
     database: str = os.path.join(os.path.dirname(__file__), "stc.db")
+    sanitrend_db: SaniTrendDatabase = field(init = False, repr = False)
     
 
     def __post_init__(self) -> None:
         with open(self.config_file) as file:
             config_data = json.load(file)
             self.plc_ip_address = config_data['Config']['PLCIPAddress']
-            self.plc_scan_rate = int(config_data['Config']['PLCScanRate'])
+            self.plc_scan_rate = max(1, int(float(config_data['Config']['PLCScanRate'])))
+            self.plc_scheduler = ScanScheduler(self.plc_scan_rate / 1000)
+            self.watchdog_rate = max(1, int(float(config_data['Config'].get('WatchdogRate', self.watchdog_rate))))
+            self.watchdog_scheduler = ScanScheduler(self.watchdog_rate / 1000)
             self.smi_number = config_data['Config']['SMINumber']
+            self.backlog_batch_bytes = int(config_data['Config'].get('BacklogBatchKB', self.backlog_batch_bytes // 1024)) * 1024
+            # 0 (or less) turns the rate limit off
+            self.backlog_drain_rate = max(0, float(config_data['Config'].get('BacklogDrainRate', self.backlog_drain_rate)))
+            # one pooled Thingworx connection is always left free for live data
+            self.backlog_concurrency = max(1, min(TWX_CONNECTION_LIMIT - 1, int(config_data['Config'].get('BacklogConcurrency', self.backlog_concurrency))))
+            backlog_max_bytes = int(float(config_data['Config'].get('BacklogMaxMB', 1024)) * 1048576)
+            backlog_max_rows = int(config_data['Config'].get('BacklogMaxRows', 0))
+            backlog_max_age = float(config_data['Config'].get('BacklogMaxAgeDays', 0)) * 86400
+            backlog_downsample = str(config_data['Config'].get('BacklogPolicy', 'drop')).lower() == 'downsample'
             self.twx_tag_table = config_data['Tags']
             for tag in self.twx_tag_table:
-                self.plc_tag_list.append(tag['tag'])
+                if tag['tag'] not in self.plc_tag_list:
+                    self.plc_tag_list.append(tag['tag'])
+
+                tag_key = TagStore.normalize(tag['tag'])
+                if tag_key not in self.twx_tag_map:
+                    twx_basetype = tag['twxtype']
+                    deadband = Deadband(
+                        float(tag.get('deadband', self.plc_tag_delta)),
+                        str(tag.get('deadbandtype', 'absolute')).lower() == 'percent',
+                        float(tag.get('maxage', 0)),
+                        self.plc_tag_delta
+                    )
+                    compression = float(tag.get('compression', 0)) if twx_basetype == 'NUMBER' else 0
+                    self.twx_tag_map[tag_key] = TwxTagConfig(
+                        tag['tag'],
+                        twx_basetype,
+                        twx_basetype.lower() == 'ignore',
+                        deadband,
+                        compression,
+                        int(tag.get('buffersize', 60)),
+                        str(tag.get('overflow', 'oldest')).lower() != 'newest'
+                    )
 
             self.plc.IPAddress = self.plc_ip_address
             self.plc.Micro800 = True
+            self.sanitrend_db = SaniTrendDatabase(self.database, backlog_max_bytes, backlog_max_rows, backlog_max_age, backlog_downsample)
+            self.twx_live_idle.set()
             return None
     
 
-    def plc_scan_timer(self) -> bool:
-        """PLC Scan Rate Timer\n
-        Scan Rate set in config file
+    async def run_plc_io(self, function, *args, priority: int = 1, **kwargs) -> any:
+        """Runs a blocking pylogix call in the PLC executor thread.\n
+        The pylogix connection is not thread safe, so calls are handed to the single
+        executor thread one at a time, lower priority numbers first. Calls still waiting
+        their turn can be cancelled without touching the PLC, and once plc_io_queue_size
+        calls are waiting new ones are rejected instead of queueing without limit.
+        Priority 0 calls (the watchdog handshake) are never rejected.\n
+        The result of every call updates plc_health. While the PLC is DOWN, calls return None
+        without touching the network until the reconnect backoff has passed, so an unplugged
+        PLC does not cost a connect timeout on every call. When the PLC comes back, the cached
+        configuration values are written again.\n
+        plc_io_times is set to the start and end time in milliseconds and the duration in seconds of
+        the call itself, measured after its turn came up, so it does not include time spent waiting
+        behind other calls. It is valid right after the await returns.
+
+        Args:
+            function (callable): pylogix PLC method to call
+            *args: positional arguments for function
+            priority (int, optional): order of waiting calls, lower first. Defaults to 1.
+            **kwargs: keyword arguments for function
 
         Returns:
-            bool: accumulated time >= timer preset
+            any: return value of function, or None if the PLC queue is full
         """
-        timer = SimpleTimer(self.plc_last_scan_time, self.plc_scan_rate)
-        if timer.done:
-            self.plc_last_scan_time = timer.timestamp
-        return timer.done
+        if priority > 0 and self.plc_io_pending >= self.plc_io_queue_size:
+            self.plc_io_rejected += 1
+            SaniTrendLogging.logger.warning(f'PLC I/O queue full ({self.plc_io_pending} waiting), skipping {function.__name__}')
+            return None
+
+        self.plc_io_pending += 1
+        try:
+            await self.plc_io_gate.acquire(priority)
+            try:
+                if self.plc_health.state == 'DOWN' and not self.plc_health.check_due():
+                    self.plc_io_short_circuited += 1
+                    return None
 
+                was_up = self.plc_health.state == 'UP'
+                loop = asyncio.get_running_loop()
+                io_start = time.perf_counter()
+                start_time = self.plc_clock.now()
+                try:
+                    result = await loop.run_in_executor(self.plc_executor, partial(function, *args, **kwargs))
 
-    async def read_tags(self, tag: str = '') -> None:
-        """Asyncio wrapper for reading tags using Pylogix
+                except Exception:
+                    self.plc_health.failure()
+                    raise
+
+                finally:
+                    self.plc_io_times = (start_time, self.plc_clock.now(), time.perf_counter() - io_start)
+
+                if plc_connection_failed(result):
+                    self.plc_health.failure()
+
+                else:
+                    self.plc_health.success()
+                    if not was_up:
+                        self.reset_plc_config_cache()
+
+                return result
+
+            finally:
+                self.plc_io_gate.release()
+
+        finally:
+            self.plc_io_pending -= 1
+
+
+    async def start(self) -> None:
+        """Opens the shared Thingworx session and starts the watchdog handshake, PLC writer, database writer and backlog drain tasks.\n
+        The session keeps its connections to the Edge Microserver alive between requests,
+        and counts how often a pooled connection is reused instead of opening a new one.
+        """
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_twx_connection_create)
+        trace_config.on_connection_reuseconn.append(self._on_twx_connection_reuse)
+        connector = aiohttp.TCPConnector(limit = TWX_CONNECTION_LIMIT, keepalive_timeout = 60)
+        self.twx_session = aiohttp.ClientSession(TWX_BASE_URL, connector = connector, trace_configs = [trace_config])
+        self.supervisor.spawn('watchdog_handshake', self.watchdog_handshake)
+        self.supervisor.spawn('write_plc_tags', self.write_plc_tags)
+        self.supervisor.spawn('write_backlog', self.write_backlog)
+        self.supervisor.spawn('drain_backlog', self.drain_backlog)
+
+
+    async def _on_twx_connection_create(self, session, context, params) -> None:
+        self.twx_conn_new += 1
+
+
+    async def _on_twx_connection_reuse(self, session, context, params) -> None:
+        self.twx_conn_reused += 1
+
+
+    async def run_db(self, function, *args) -> any:
+        """Runs a blocking SaniTrendDatabase call in the database executor thread.\n
+        Every database call goes through the single executor thread, so sqlite3 never blocks the
+        event loop and calls on the shared connection never overlap.
 
         Args:
-            tag (str, optional): Tag name in PLC (must be global scoped). Defaults to ''.
+            function (callable): SaniTrendDatabase method to call
+            *args: arguments for function
+
+        Returns:
+            any: return value of function
         """
-        try: 
-            new_data = await self.read_tag_data(tag)
-        
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.db_executor, partial(function, *args))
+
+
+    async def close(self) -> None:
+        """Writes data still waiting for the database, cancels running jobs, closes the Thingworx session, PLC connection
+        and database, and stops the executor threads
+        """
+        try:
+            await asyncio.wait_for(self.db_queue.join(), 10)
+
+        except asyncio.TimeoutError:
+            SaniTrendLogging.logger.error(f'{self.db_queue.qsize()} uploads were not written to the database before closing')
+
+        await self.supervisor.cancel_all()
+        self.plc_write_queue.cancel_all()
+        if self.twx_session is not None:
+            await self.twx_session.close()
+            self.twx_session = None
+
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.plc_executor, self.plc.Close)
+
         except Exception as e:
             SaniTrendLogging.logger.error(repr(e))
-            
-        if new_data:
-            if isinstance(new_data.Value, float):
-                new_data.Value = round(new_data.Value, 2)    
-
-            add_data = True
-            for old_data in self.plc_data:
-                if old_data.TagName == new_data.TagName:
-                    add_data = False
-                    if new_data.Value is not None:
-                        if old_data.Value is None:
-                            old_data.Value = 0
-                        if isinstance(new_data.Value, float):
-                            if abs(old_data.Value - new_data.Value) >= self.plc_tag_delta:
-                                old_data.Value = new_data.Value
-
-                        else:
-                            if old_data.Value != new_data.Value:
-                                old_data.Value = new_data.Value
-
-            if add_data:
-                self.plc_data.append(new_data)
+
+        self.plc_executor.shutdown(wait = False, cancel_futures = True)
+        await self.run_db(self.sanitrend_db.close)
+        self.db_executor.shutdown(wait = False)
+
+
+    async def scan_tags(self) -> None:
+        """Reads every configured tag in one read cycle and records the scan latency
+        """
+        if not self.plc_tag_list:
+            return None
+
+        try:
+            new_data = await self.read_tag_data(self.plc_tag_list)
+
+        except Exception as e:
+            SaniTrendLogging.logger.error(repr(e))
+            return None
+
+        if new_data is None:
+            return None
+
+        # stamp the samples halfway through the read, the values were sampled somewhere in between
+        read_start, read_end, read_seconds = self.plc_io_times
+        timestamp = (read_start + read_end) // 2
+        self.plc_scan_latency = round(read_seconds * 1000, 1)
+        self.plc_scan_latency_max = max(self.plc_scan_latency, self.plc_scan_latency_max)
+        self.plc_scan_count += 1
+        if self.plc_scan_latency > self.plc_scan_rate:
+            SaniTrendLogging.logger.warning(f'PLC scan took {self.plc_scan_latency} ms, longer than the {self.plc_scan_rate} ms scan rate')
+
+        if isinstance(new_data, list):
+            for tag_data in new_data:
+                self.update_tag_data(tag_data, timestamp)
+
+
+    def update_tag_data(self, new_data: lgx_response, timestamp: int = None) -> None:
+        """Merges a tag read from the PLC into the plc_data tag store
+
+        Args:
+            new_data (lgx_response): TagName, Value, and Status of tag.
+            timestamp (int, optional): time the tag was read in milliseconds. Defaults to None, which uses the current time.
+        """
+        record = self.plc_data.get(new_data.TagName)
+        if timestamp is None:
+            timestamp = self.plc_clock.now()
+        twx_config = self.twx_tag_map.get(TagStore.normalize(new_data.TagName))
+        if record is None:
+            record = self.plc_data.add(new_data.TagName)
+            record.value = new_data.Value
+            record.timestamp = timestamp
+            if twx_config is not None and not twx_config.ignore:
+                record.samples = SampleBuffer(twx_config.buffer_size, twx_config.buffer_drop_oldest)
+            self.plc_data.mark_dirty(record)
+            if twx_config is not None and twx_config.compression > 0:
+                record.compressor = SwingingDoor(twx_config.compression)
+                if isinstance(new_data.Value, float):
+                    record.compressor.reset(timestamp, new_data.Value)
+
+        elif new_data.Value is not None:
+            deadband = twx_config.deadband if twx_config is not None else Deadband(self.plc_tag_delta)
+            if record.value is None or deadband.expired(record.timestamp, timestamp):
+                if record.compressor is not None and isinstance(new_data.Value, float):
+                    # publish the held point first, so the trend up to it stays within deviation
+                    point = record.compressor.flush()
+                    if point is not None:
+                        record.timestamp, record.value = point
+                        self.plc_data.mark_dirty(record)
+                    record.compressor.reset(timestamp, new_data.Value)
+
+                record.value = new_data.Value
+                record.timestamp = timestamp
+                self.plc_data.mark_dirty(record)
+
+            elif record.compressor is not None and isinstance(new_data.Value, float):
+                point = record.compressor.add(timestamp, new_data.Value)
+                if point is not None:
+                    record.timestamp, record.value = point
+                    self.plc_data.mark_dirty(record)
+
+            else:
+                if isinstance(new_data.Value, float):
+                    changed = deadband.passes(record.value, new_data.Value)
+
+                else:
+                    changed = record.value != new_data.Value
+
+                if changed:
+                    record.value = new_data.Value
+                    record.timestamp = timestamp
+                    self.plc_data.mark_dirty(record)
+
+        record.status = new_data.Status
         
 
     async def read_tag_data(self, tags: list = []) -> lgx_response:
@@ -219,147 +1491,385 @@ class STC:
             tags (list, optional): list of tags. Defaults to [].
 
         Returns:
-            lgx_response: returns TagName, Value, and Status of tag.
+            lgx_response: returns TagName, Value, and Status of tag, or a list of them when a list of tags is read.
         """
-        return self.plc.Read(tags)
+        return await self.run_plc_io(self.plc.Read, tags)
 
 
-    async def write_tags(self, tag_list: list = []) -> None:
-        """Asyncio wrapper for writing tag values to PLC
-
-        Args:
-            tag_list (list, optional): list of tuples containing tagnames and values. Defaults to [].
+    async def watchdog_handshake(self) -> None:
+        """Echoes PLC_Watchdog back to SaniTrend_Watchdog on its own schedule.\n
+        Runs in the background for the life of the service. Every watchdog_rate milliseconds both
+        watchdog tags are read, and when they differ the PLC value is written straight back. Both
+        calls go ahead of any bulk PLC reads and writes that are waiting, so a busy scan does not
+        delay the handshake. The time from the start of the read to the end of the echo write is
+        kept as the watchdog latency.
         """
-        try:
-            for tag in tag_list:
-                x = await self.write_tag_data(tag)
+        while True:
+            await self.watchdog_scheduler.wait()
+            try:
+                handshake_start = time.perf_counter()
+                responses = await self.run_plc_io(self.plc.Read, WATCHDOG_TAGS, priority = 0)
+                if not isinstance(responses, list) or len(responses) != len(WATCHDOG_TAGS):
+                    continue
 
-        except Exception as e:
-            SaniTrendLogging.logger.error(repr(e))
+                # same midpoint stamp as scan_tags, so updates to the watchdog tags stay in time order
+                read_start, read_end, read_seconds = self.plc_io_times
+                timestamp = (read_start + read_end) // 2
+
+                for tag_data in responses:
+                    self.update_tag_data(tag_data, timestamp)
+
+                plc_watchdog, sanitrend_watchdog = responses
+                if plc_watchdog.Status != 'Success' or sanitrend_watchdog.Status != 'Success':
+                    continue
+
+                if plc_watchdog.Value != sanitrend_watchdog.Value:
+                    response = await self.run_plc_io(self.plc.Write, 'SaniTrend_Watchdog', plc_watchdog.Value, priority = 0)
+                    if response is not None and response.Status == 'Success':
+                        self.watchdog_echoes += 1
+                        self.watchdog_latency = round((time.perf_counter() - handshake_start) * 1000, 1)
+                        self.watchdog_latency_max = max(self.watchdog_latency, self.watchdog_latency_max)
 
+            except asyncio.CancelledError:
+                raise
 
-    async def write_tag_data(self, tag) -> None:
-        """Asyncio wrapper for writing tag data using Pylogix
+            except Exception as e:
+                SaniTrendLogging.logger.error(repr(e))
+
+
+    async def write_tags(self, tag_list: list = []) -> list:
+        """Queues tag values for the PLC writer and waits until they are written
 
         Args:
-            tag (tuple): tuple of TagName and Value
+            tag_list (list, optional): list of tuples containing tagnames and values. Defaults to [].
 
         Returns:
-            None: None
+            list: lgx_response of each write, None for writes that could not be sent
         """
-        tag_name, tag_value = tag
-        self.plc.Write(tag_name, tag_value)
+        futures = [self.plc_write_queue.put(tag_name, tag_value) for tag_name, tag_value in tag_list]
+        return list(await asyncio.gather(*futures))
 
 
-    async def upload_tag_data_to_twx(self) -> None:
-        """Uploads plc tag data to Thingworx
-        """
-        new_data = []
-        for tag_data in self.plc_data:
-            add_tag = True
-            for old_data in self.plc_data_buffer:
-                tag_name = old_data['TagName']
-                if tag_data.TagName == tag_name:
-                    add_tag = False
-                    if tag_data.Value != old_data['Value']:
-                        old_data['Value'] = tag_data.Value
-                        new_data.append(tag_data)
-
-            if add_tag:
-                data_to_add = {
-                    'TagName': tag_data.TagName,
-                    'Value': tag_data.Value,
-                    'Status': tag_data.Status
-                }
+    async def write_plc_tags(self) -> None:
+        """Sends queued tag writes to the PLC.\n
+        Runs in the background for the life of the service. Every write waiting in plc_write_queue
+        is sent in one list PLC.Write call, which pylogix packs into multiple service packets.
+        """
+        while True:
+            pending = await self.plc_write_queue.take()
+            tags = [(tag_name, value) for tag_name, (value, futures) in pending.items()]
+            try:
+                responses = await self.run_plc_io(self.plc.Write, tags)
+                self.plc_write_batches += 1
+
+            except asyncio.CancelledError:
+                for value, futures in pending.values():
+                    for future in futures:
+                        future.cancel()
+                raise
+
+            except Exception as e:
+                SaniTrendLogging.logger.error(repr(e))
+                responses = None
+
+            if not isinstance(responses, list):
+                responses = [None] * len(tags)
+
+            for response, (value, futures) in zip(responses, pending.values()):
+                for future in futures:
+                    if not future.done():
+                        future.set_result(response)
+
 
-                self.plc_data_buffer.append(data_to_add)
-                new_data.append(tag_data)
+    async def upload_tag_data_to_twx(self) -> None:
+        """Uploads plc tag data to Thingworx.\n
+        Each row carries the time its value was read from the PLC, so data queued in the database
+        during an outage is replayed with the original times. Every sample buffered since the last
+        upload is sent as its own row.
+        """
+        new_data = self.plc_data.pop_dirty()
 
         if new_data:
-            ignore_type = 'ignore'
-            timestamp = int(round(time.time() * 1000))
             for item in new_data:
-                twx_value = {}
-                twx_tag = ''
-                twx_basetype = ''
-                for twx_config in self.twx_tag_table:
-                    if item.TagName == twx_config['tag']:
-                        twx_tag = twx_config['tag']
-                        twx_basetype = twx_config['twxtype']
-                        break
-                
-                if twx_tag and twx_basetype.lower() != ignore_type:
-                    tag_value = item.Value
-                    if tag_value is None:
-                        continue
+                twx_config = self.twx_tag_map.get(TagStore.normalize(item.tag_name))
+                if twx_config is None or twx_config.ignore:
+                    continue
 
-                    else:
-                        if twx_basetype == 'NUMBER':
-                            if isinf(tag_value):
-                                continue
+                if item.samples is not None:
+                    samples = item.samples.drain()
 
-                            else:
-                                twx_tag_value = round(tag_value,2)
+                else:
+                    samples = [(item.timestamp, item.value)]
+
+                for sample_time, tag_value in samples:
+                    if tag_value is None:
+                        continue
 
-                        else:
-                            twx_tag_value = tag_value
+                    if twx_config.base_type == 'NUMBER':
+                        if isinf(tag_value):
+                            continue
 
-                    twx_value['time'] = timestamp
-                    twx_value['quality'] = 'GOOD'
-                    twx_value['name'] = twx_tag
+                        twx_tag_value = round(tag_value,2)
 
-                    twx_value['value'] = {
-                        'value': twx_tag_value,
-                        'baseType': twx_basetype
+                    else:
+                        twx_tag_value = tag_value
+
+                    twx_value = {
+                        'time': sample_time,
+                        'quality': 'GOOD',
+                        'name': twx_config.twx_name,
+                        'value': {
+                            'value': twx_tag_value,
+                            'baseType': twx_config.base_type
+                        }
                     }
-                    
+
                     self.twx_upload_data.append(twx_value)
             
             if self.twx_connected:
                 url = f'/Thingworx/Things/{self.smi_number}/Services/UpdatePropertyValues'
-                response = await twx_request('update_tag_values', url, 'status', self.twx_upload_data)
-                if response != 200 and not self.db_busy:
-                    self.db_busy = True
-                    success = SaniTrendDatabase.log_twx_data_to_db(self.twx_upload_data, self.database)
-                    if success:
-                        self.twx_upload_data = []
-                    
-                    self.db_busy = False
-
-                elif response == 200:
+                self.twx_live_idle.clear()
+                try:
+                    response = await twx_request('update_tag_values', url, 'status', self.twx_upload_data, session = self.twx_session)
+
+                finally:
+                    self.twx_live_idle.set()
+
+                if response == 200:
+                    self.twx_health.success()
                     self.twx_upload_data = []
-                    self.db_busy = True
-                    upload_response = await SaniTrendDatabase.upload_twx_data_from_db(self.database, url)
-                    self.db_busy = False
+                    self.backlog_event.set()
+
+                else:
+                    self.twx_health.failure()
+                    self.twx_connected = self.twx_health.state != 'DOWN'
+                    await self.queue_twx_data()
 
             else:
-                if not self.db_busy and self.twx_upload_data:
-                    self.db_busy = True
-                    success = SaniTrendDatabase.log_twx_data_to_db(self.twx_upload_data, self.database)
-                    if success:
-                        self.twx_upload_data = []
+                await self.queue_twx_data()
+
+
+    async def queue_twx_data(self) -> None:
+        """Hands the pending Thingworx data to the database write-behind queue.\n
+        Waits while the queue is full, so a database that cannot keep up holds back the uploads
+        instead of letting pending data grow without limit.
+        """
+        if not self.twx_upload_data:
+            return None
+
+        rows = self.twx_upload_data
+        self.twx_upload_data = []
+        try:
+            await self.db_queue.put(rows)
+
+        except asyncio.CancelledError:
+            self.twx_upload_data = rows + self.twx_upload_data
+            raise
+
+
+    async def write_backlog(self) -> None:
+        """Writes queued Thingworx data to the database.\n
+        Runs in the background for the life of the service. Everything waiting in the queue is
+        written as one batch in the database executor thread. A batch that fails to write is
+        retried until it succeeds, and is only taken off the queue once it is stored.
+        """
+        while True:
+            items = [await self.db_queue.get()]
+            while not self.db_queue.empty():
+                items.append(self.db_queue.get_nowait())
+
+            rows = [row for item in items for row in item]
+            try:
+                while not await self.run_db(self.sanitrend_db.log_twx_data_to_db, rows):
+                    self.db_write_failures += 1
+                    await asyncio.sleep(1)
+
+                self.db_write_batches += 1
+                self.backlog_event.set()
+
+            finally:
+                for item in items:
+                    self.db_queue.task_done()
+
+
+    async def drain_backlog(self) -> None:
+        """Uploads data queued in the database during Thingworx outages.\n
+        Runs in the background for the life of the service. While Thingworx is UP and the queue
+        has data, it is replayed by replay_backlog. When the queue is empty it returns free database pages
+        to the disk and waits until a live upload succeeds or 10 seconds pass.
+        """
+        url = f'/Thingworx/Things/{self.smi_number}/Services/UpdatePropertyValues'
+        while True:
+            try:
+                if self.twx_health.state != 'UP' or not await self.run_db(self.sanitrend_db.has_twx_data):
+                    await self.run_db(self.sanitrend_db.incremental_vacuum)
+                    self.backlog_event.clear()
+                    try:
+                        await asyncio.wait_for(self.backlog_event.wait(), 10)
+
+                    except asyncio.TimeoutError:
+                        pass
+
+                    continue
+
+                if not await self.replay_backlog(url):
+                    await asyncio.sleep(10)
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception as e:
+                SaniTrendLogging.logger.error(repr(e))
+                await asyncio.sleep(10)
+
+
+    async def replay_backlog(self, url: str) -> bool:
+        """Uploads the queued data with up to backlog_concurrency uploads in flight.\n
+        Batches of up to backlog_batch_bytes are started oldest first at no more than backlog_drain_rate
+        per second (no limit when it is 0), and a new batch is not started while a live upload is in
+        flight. Batches are acknowledged in order: once the oldest in-flight batch is accepted, it and
+        every accepted batch right after it are deleted as one ROWID range. After a failed batch no new
+        batches are started, the batches still in flight are finished and deleted if accepted, and the
+        failed ones are left queued for the next pass.
+
+        Args:
+            url (str): url of Thingworx "Thing" UpdatePropertyValues service.
+
+        Returns:
+            bool: True if the queue was emptied or Thingworx is no longer UP, False if an upload failed
+        """
+        in_flight = []
+        after_id = 0
+        failed = False
+        try:
+            while True:
+                while not failed and self.twx_health.state == 'UP' and len(in_flight) < self.backlog_concurrency:
+                    await self.twx_live_idle.wait()
+                    batch = await self.run_db(self.sanitrend_db.read_twx_batch, after_id, self.backlog_batch_bytes)
+                    if batch is None:
+                        failed = True
+                        break
+
+                    first_id, last_id, rows = batch
+                    if first_id is None:
+                        break
+
+                    after_id = last_id
+                    request = twx_request('update_tag_values', url, 'status', rows, session = self.twx_session)
+                    in_flight.append((first_id, last_id, asyncio.create_task(request)))
+                    self.backlog_in_flight = len(in_flight)
+                    if self.backlog_drain_rate > 0:
+                        await asyncio.sleep(1 / self.backlog_drain_rate)
+
+                if not in_flight:
+                    return not failed
+
+                await asyncio.wait([in_flight[0][2]])
+                acked_first = None
+                acked_last = None
+                while in_flight and in_flight[0][2].done():
+                    first_id, last_id, task = in_flight.pop(0)
+                    if task.result() == 200:
+                        self.twx_health.success()
+                        if acked_first is None:
+                            acked_first = first_id
+                        acked_last = last_id
+                        continue
+
+                    failed = True
+                    self.twx_health.failure()
+                    self.twx_connected = self.twx_health.state != 'DOWN'
+                    if acked_first is not None:
+                        await self.run_db(self.sanitrend_db.delete_twx_data, acked_first, acked_last)
+                        acked_first = None
+
+                if acked_first is not None:
+                    await self.run_db(self.sanitrend_db.delete_twx_data, acked_first, acked_last)
+
+                self.backlog_in_flight = len(in_flight)
+
+        finally:
+            for first_id, last_id, task in in_flight:
+                task.cancel()
+
+            self.backlog_in_flight = 0
+
+
+    def get_metrics(self) -> dict:
+        """Runtime statistics for monitoring the SaniTrend™ Cloud Lite service
+
+        Returns:
+            dict: metric name and value
+        """
+        return {
+            'plc_scan_count': self.plc_scan_count,
+            'plc_scan_latency_ms': self.plc_scan_latency,
+            'plc_scan_latency_max_ms': self.plc_scan_latency_max,
+            'plc_scan_overruns': self.plc_scheduler.overruns,
+            'plc_scans_skipped': self.plc_scheduler.skipped,
+            'watchdog_echoes': self.watchdog_echoes,
+            'watchdog_latency_ms': self.watchdog_latency,
+            'watchdog_latency_max_ms': self.watchdog_latency_max,
+            'plc_state': self.plc_health.state,
+            'plc_state_transitions': dict(self.plc_health.transitions),
+            'plc_connection_size': self.plc.conn.ConnectionSize,
+            'plc_io_short_circuited': self.plc_io_short_circuited,
+            'plc_io_pending': self.plc_io_pending,
+            'plc_io_rejected': self.plc_io_rejected,
+            'plc_config_writes': self.plc_config_writes,
+            'plc_write_batches': self.plc_write_batches,
+            'plc_writes_coalesced': self.plc_write_queue.coalesced,
+            'twx_state': self.twx_health.state,
+            'twx_state_transitions': dict(self.twx_health.transitions),
+            'twx_connections_new': self.twx_conn_new,
+            'twx_connections_reused': self.twx_conn_reused,
+            'backlog_batches': self.sanitrend_db.queued_batches,
+            'backlog_in_flight': self.backlog_in_flight,
+            'backlog_rows': self.sanitrend_db.queued_rows,
+            'backlog_bytes': self.sanitrend_db.queued_bytes,
+            'backlog_rows_dropped': self.sanitrend_db.dropped_rows,
+            'backlog_batches_quarantined': self.sanitrend_db.quarantined_batches,
+            'db_queue_size': self.db_queue.qsize(),
+            'db_write_batches': self.db_write_batches,
+            'db_write_failures': self.db_write_failures,
+            'samples_dropped': sum(record.samples.dropped for record in self.plc_data if record.samples is not None),
+            'tasks_in_flight': self.supervisor.in_flight(),
+            'dropped_cycles': dict(self.supervisor.dropped),
+        }
+
+
+    async def log_metrics(self) -> None:
+        """Logs the runtime statistics every 5 minutes, along with the database file size and oldest queued time
+        """
+        timer = SimpleTimer(self.metrics_last_log_time, 300000)
+        if timer.done:
+            self.metrics_last_log_time = timer.timestamp
+            metrics = self.get_metrics()
+            metrics['backlog_file_bytes'] = await self.run_db(self.sanitrend_db.file_bytes)
+            metrics['backlog_oldest_time'] = await self.run_db(self.sanitrend_db.oldest_time)
+            SaniTrendLogging.logger.info(f'Metrics: {metrics}')
 
-                    self.db_busy = False
-                                  
 
     async def get_twx_connection_status(self) -> None:
-        """Gets connection status of PC to Thingworx
+        """Gets connection status of PC to Thingworx.\n
+        The Edge Microserver is only asked when twx_health says a check is due: every 10 seconds
+        while UP, backed off exponentially after failures, and not at all while live uploads keep
+        succeeding, since those already prove the connection is up.
         """
-        timer = SimpleTimer(self.twx_last_conn_test, 10000)
         url = '/Thingworx/Things/LocalEms/Properties/isConnected'
-        if timer.done:
-            self.twx_last_conn_test = timer.timestamp
-            response = await twx_request('get', url)
+        if self.twx_health.check_due():
+            response = await twx_request('get', url, session = self.twx_session)
             if isinstance(response, dict):
-                self.twx_connected = response['rows'][0]['isConnected']
-                self.twx_conn_fail_count = 0
+                if response['rows'][0]['isConnected']:
+                    self.twx_health.success()
+
+                else:
+                    self.twx_health.failure(definite = True)
 
             else:
-                self.twx_conn_fail_count += 1
-                self.twx_connected = False
-                self.twx_conn_fail_count += 1
-                if self.twx_conn_fail_count > 12:
-                    self.twx_last_conn_test += 60000
+                self.twx_health.failure()
+
+            self.twx_connected = self.twx_health.state != 'DOWN'
 
 
     async def get_stc_config(self):
@@ -369,10 +1879,14 @@ class STC:
         timer = SimpleTimer(self.remote_plc_last_config_time, 10000)
         if timer.done and self.twx_connected:
             self.remote_plc_last_config_time = timer.timestamp
-            response = await twx_request('post', url)
+            response = await twx_request('post', url, session = self.twx_session)
             if isinstance(response, dict):
-                self.remote_plc_config = []
                 result = response['rows'][0]
+                config_hash = hashlib.sha1(encode_json(result)).hexdigest()
+                if config_hash == self.remote_plc_config_hash:
+                    return None
+
+                self.remote_plc_config = []
                 rows = result['PropertyConfig']['rows']
                 analog = 'ANALOG'
                 digital = 'DIGITAL'
@@ -402,6 +1916,16 @@ class STC:
                         if key == 'Units':
                             units = value
 
+                    twx_config = self.twx_tag_map.get(TagStore.normalize(property_name))
+                    # a blank EUMin or EUMax leaves the span unknown
+                    if twx_config is not None and property.get('EUMin', '') != '' and property.get('EUMax', '') != '':
+                        try:
+                            twx_config.deadband.eu_min = float(units_min)
+                            twx_config.deadband.eu_max = float(units_max)
+
+                        except (TypeError, ValueError):
+                            pass
+
                     property_name_parts = property_name.split('_')
                     property_type = property_name_parts[0]
                     if property_type.upper() in analog:
@@ -431,7 +1955,43 @@ class STC:
                 self.remote_plc_config.append(('Virtualize_DIn', result['Virtualize_DIn']))
                 self.remote_plc_config.append(('Virtualize_String', result['Virtualize_String']))
 
-        asyncio.create_task(self.write_tags(self.remote_plc_config))
+                changes = [tag for tag in self.remote_plc_config if tag[0] not in self.plc_config_applied or self.plc_config_applied[tag[0]] != tag[1]]
+                if changes:
+                    self.supervisor.spawn('write_config', self.write_config, changes, config_hash)
+
+                else:
+                    self.remote_plc_config_hash = config_hash
+
+
+    async def write_config(self, tag_list: list, config_hash: str) -> None:
+        """Writes changed configuration values to the PLC and remembers the ones the PLC accepted.\n
+        The configuration hash is only stored once every value was written, so failed writes are
+        retried the next time the configuration is read from Thingworx.
+
+        Args:
+            tag_list (list): list of tuples containing tagnames and values
+            config_hash (str): hash of the Thingworx configuration the values came from
+        """
+        failed = False
+        responses = await self.write_tags(tag_list)
+        for tag, response in zip(tag_list, responses):
+            if response is not None and response.Status == 'Success':
+                self.plc_config_applied[tag[0]] = tag[1]
+                self.plc_config_writes += 1
+
+            else:
+                failed = True
+
+        if not failed:
+            self.remote_plc_config_hash = config_hash
+
+
+    def reset_plc_config_cache(self) -> None:
+        """Forgets the configuration values written to the PLC, so all of them are written again.\n
+        Used when communication with the PLC is restored, since the PLC may have been reloaded or replaced.
+        """
+        self.remote_plc_config_hash = ''
+        self.plc_config_applied.clear()
 
 
 
@@ -444,23 +2004,149 @@ def reboot_pc() -> None:
         os.system('sudo reboot')
         
 
-def get_tag_value(tag_data: list = [], tag_name: str = '') -> any:
-    """Gets tag value given list of tag data from pylogix
+def get_tag_value(tag_data: TagStore = None, tag_name: str = '') -> any:
+    """Gets tag value from the tag store
 
     Args:
-        tag_data (list, optional): list of tag data from Pylogix. Defaults to [].
+        tag_data (TagStore, optional): tag store holding the PLC tag data. Defaults to None.
         tag_name (str, optional): name of tag from which to get the value. Defaults to ''.
 
     Returns:
         any: value of tag
     """
     if tag_data and tag_name:
-        values = (tag.Value for tag in tag_data if tag.TagName.lower() == tag_name.lower())
-        for value in values:
-            return value
+        return tag_data.value(tag_name)
+
+
+def plc_connection_failed(result: any) -> bool:
+    """Checks whether a pylogix result shows that the PLC could not be reached
+
+    Args:
+        result (any): lgx_response or list of lgx_response returned by pylogix
+
+    Returns:
+        bool: True if every response failed to reach the PLC
+    """
+    responses = result if isinstance(result, list) else [result]
+    responses = [response for response in responses if isinstance(response, lgx_response.Response)]
+    if not responses:
+        return False
+
+    for response in responses:
+        status = str(response.Status)
+        if status not in PLC_CONNECTION_ERRORS and not status.startswith('Unknown error'):
+            return False
 
+    return True
 
-async def twx_request(request_type: str, url: str, response_type: str = 'json', data: list = [], timeout: int = 5) -> any:
+
+TWX_DATASHAPE = {
+    'fieldDefinitions': {
+        'name': {
+            'name': 'name',
+            'aspects': {
+                'isPrimaryKey': True
+            },
+        'description': 'Property name',
+        'baseType': 'STRING',
+        'ordinal': 0
+        },
+        'time': {
+            'name': 'time',
+            'aspects': {},
+            'description': 'time',
+            'baseType': 'DATETIME',
+            'ordinal': 0
+        },
+        'value': {
+            'name': 'value',
+            'aspects': {},
+            'description': 'value',
+            'baseType': 'VARIANT',
+            'ordinal': 0
+        },
+        'quality': {
+            'name': 'quality',
+            'aspects': {},
+            'description': 'quality',
+            'baseType': 'STRING',
+            'ordinal': 0
+        }
+    }
+}
+
+
+def encode_json(data: any) -> bytes:
+    """Encodes data as compact JSON, using orjson when it is installed
+
+    Args:
+        data (any): data to encode
+
+    Returns:
+        bytes: utf-8 encoded JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+
+    return json.dumps(data, separators = (',', ':')).encode('utf-8')
+
+
+def decode_json(data: bytes) -> any:
+    """Decodes JSON, using orjson when it is installed
+
+    Args:
+        data (bytes): utf-8 encoded JSON
+
+    Returns:
+        any: decoded data
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+
+    return json.loads(data)
+
+
+def downsample_rows(rows: list) -> list:
+    """Halves the samples of each tag in a list of Thingworx rows, keeping every other sample counting back from the newest
+
+    Args:
+        rows (list): Thingworx property rows with time, quality, name and value
+
+    Returns:
+        list: rows kept, in their original order
+    """
+    remaining = {}
+    for row in rows:
+        remaining[row['name']] = remaining.get(row['name'], 0) + 1
+
+    kept = []
+    for row in rows:
+        remaining[row['name']] -= 1
+        if remaining[row['name']] % 2 == 0:
+            kept.append(row)
+
+    return kept
+
+
+TWX_VALUES_PREFIX = b'{"values":{"dataShape":' + encode_json(TWX_DATASHAPE) + b',"rows":'
+TWX_VALUES_SUFFIX = b'}}'
+
+
+def build_twx_values(rows: list, encoder: callable = encode_json) -> bytes:
+    """Builds the body of an UpdatePropertyValues request.\n
+    The datashape never changes, so it is encoded once at import and only the rows are encoded per request.
+
+    Args:
+        rows (list): Thingworx property rows with time, quality, name and value
+        encoder (callable, optional): function encoding a list to JSON bytes. Defaults to encode_json.
+
+    Returns:
+        bytes: JSON request body
+    """
+    return TWX_VALUES_PREFIX + encoder(rows) + TWX_VALUES_SUFFIX
+
+
+async def twx_request(request_type: str, url: str, response_type: str = 'json', data: list = [], timeout: int = 5, session: aiohttp.ClientSession = None, encoder: callable = encode_json) -> any:
     """Process Thingworx REST requests
 
     Args:
@@ -469,14 +2155,12 @@ async def twx_request(request_type: str, url: str, response_type: str = 'json',
         response_type (str, optional): 'json' data from REST request, or http 'status' of REST request. Defaults to 'json'.
         data (list, optional): data for POST requests. Defaults to [].
         timeout (int, optional): http timeout. Defaults to 5.
+        session (aiohttp.ClientSession, optional): shared session to send the request on, a temporary one is opened if None. Defaults to None.
+        encoder (callable, optional): function encoding the 'update_tag_values' rows to JSON bytes. Defaults to encode_json.
 
     Returns:
         any: json or status depending on 'response_type'
     """
-    new_data =  []
-    if data:
-        new_data = data.copy()
-
     post_data = {}
     headers = {
         'Connection' : 'keep-alive',
@@ -484,73 +2168,39 @@ async def twx_request(request_type: str, url: str, response_type: str = 'json',
         'Content-Type' : 'application/json'
     }
 
-    datashape = {
-        'fieldDefinitions': {
-            'name': {
-                'name': 'name',
-                'aspects': {
-                    'isPrimaryKey': True
-                },
-            'description': 'Property name',
-            'baseType': 'STRING',
-            'ordinal': 0
-            },
-            'time': {
-                'name': 'time',
-                'aspects': {},
-                'description': 'time',
-                'baseType': 'DATETIME',
-                'ordinal': 0
-            },
-            'value': {
-                'name': 'value',
-                'aspects': {},
-                'description': 'value',
-                'baseType': 'VARIANT',
-                'ordinal': 0
-            },
-            'quality': {
-                'name': 'quality',
-                'aspects': {},
-                'description': 'quality',
-                'baseType': 'STRING',
-                'ordinal': 0
-            }
-        }
+    if session is None:
+        async with aiohttp.ClientSession(TWX_BASE_URL) as session:
+            return await twx_request(request_type, url, response_type, data, timeout, session, encoder)
+
+    request_types = {
+        'get': session.get,
+        'post': session.post,
+        'update_tag_values': session.post
     }
 
-    async with aiohttp.ClientSession('http://localhost:8000') as session:
-        request_types = {
-            'get': session.get,
-            'post': session.post,
-            'update_tag_values': session.post
-        }
+    request_type = request_type.lower()
+    if request_type in request_types:
+        if request_type == 'update_tag_values':
+            body = build_twx_values(data, encoder)
 
-        request_type = request_type.lower()
-        if request_type in request_types:
-            if request_type == 'update_tag_values':
-                values = {}
-                values['rows'] = new_data
-                values['dataShape'] = datashape
-                post_data = {
-                    'values': values
-                }
+        else:
+            body = encode_json(post_data)
 
-            try:
-                async with request_types[request_type](url, headers = headers, json = post_data, timeout = 5) as response:
-                    response_json = await response.json(content_type=None)
-                    if response_type == 'json':
-                        if response.status == 200:
-                            return response_json
-                            
-                        else:
-                            return None
-
-                    elif response_type == 'status':
-                        return response.status
+        try:
+            async with request_types[request_type](url, headers = headers, data = body, timeout = aiohttp.ClientTimeout(total = timeout)) as response:
+                response_json = await response.json(content_type=None)
+                if response_type == 'json':
+                    if response.status == 200:
+                        return response_json
+                        
+                    else:
+                        return None
 
-            except Exception as e:
-                SaniTrendLogging.logger.error(repr(e))
+                elif response_type == 'status':
+                    return response.status
 
-        else:
-            SaniTrendLogging.logger.exception('Request method not defined.')
\ No newline at end of file
+        except Exception as e:
+            SaniTrendLogging.logger.error(repr(e))
+
+    else:
+        SaniTrendLogging.logger.exception('Request method not defined.')
@@ -0,0 +1,135 @@
+"""Checks the asyncio pylogix transport against a local fake CIP server.
+
+Run with pytest, or directly with python test_async_comm.py
+"""
+import asyncio
+import os
+import socket
+import sys
+from struct import pack, unpack_from
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'STC_Lite_Win'))
+
+from pylogix import PLC
+from pylogix.lgx_async_comm import AsyncConnection
+
+
+SESSION_HANDLE = 0x1234
+OT_CONNECTION_ID = 0x5678
+# Get Attribute Single, identity object vendor ID
+GET_VENDOR = bytes([0x0e, 0x02, 0x20, 0x01, 0x24, 0x01, 0x30, 0x01])
+
+
+def encapsulation(command: int, session: int, payload: bytes) -> bytes:
+    return pack('<HHII8sI', command, len(payload), session, 0, bytes(8), 0) + payload
+
+
+def cip_reply(request: bytes) -> bytes:
+    service = request[0]
+    if service == 0x0e:
+        return bytes([service | 0x80, 0, 0, 0]) + pack('<H', 1)
+
+    # service not supported
+    return bytes([service | 0x80, 0, 0x08, 0])
+
+
+async def fake_cip_server(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            header = await reader.readexactly(24)
+            command, length, session = unpack_from('<HHI', header)
+            payload = await reader.readexactly(length)
+            if command == 0x65:
+                # register session
+                reply = encapsulation(command, SESSION_HANDLE, payload)
+
+            elif command == 0x6f:
+                # SendRRData, forward open (0x54, large 0x5b) or forward close (0x4e)
+                service = payload[16]
+                cip = bytes([service | 0x80, 0, 0, 0])
+                if service in (0x54, 0x5b):
+                    cip += pack('<II', OT_CONNECTION_ID, 0) + bytes(18)
+                items = pack('<HHHHH', 2, 0, 0, 0xb2, len(cip)) + cip
+                reply = encapsulation(command, session, bytes(6) + items)
+
+            elif command == 0x70:
+                # SendUnitData, connected request after the sequence count
+                sequence = payload[20:22]
+                cip = sequence + cip_reply(payload[22:])
+                items = pack('<HHHI', 2, 0xa1, 4, OT_CONNECTION_ID) + pack('<HH', 0xb1, len(cip)) + cip
+                reply = encapsulation(command, session, bytes(6) + items)
+
+            else:
+                # unregister session
+                break
+
+            writer.write(reply)
+            await writer.drain()
+
+    except asyncio.IncompleteReadError:
+        pass
+
+    finally:
+        writer.close()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def async_connection(port: int) -> AsyncConnection:
+    plc = PLC('127.0.0.1')
+    plc.Port = port
+    plc.SocketTimeout = 2
+    return AsyncConnection(plc)
+
+
+async def connected_send() -> None:
+    server = await asyncio.start_server(fake_cip_server, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        conn = async_connection(port)
+        ret = await conn.connect()
+        assert ret == [True, 'Success'], ret
+        assert conn._session_handle == SESSION_HANDLE
+        assert conn._ot_connection_id == OT_CONNECTION_ID
+        assert conn.ConnectionSize == 4002
+
+        status, ret_data = await conn.send(GET_VENDOR)
+        assert status == 0
+        assert unpack_from('<H', ret_data, 50)[0] == 1
+
+        status, ret_data = await conn.send(bytes([0x4b, 0x02, 0x20, 0x01, 0x24, 0x01]))
+        assert status == 0x08
+
+        await conn.close()
+        assert not conn.SocketConnected
+
+
+async def refused_connection() -> None:
+    conn = async_connection(free_port())
+    ret = await conn.connect()
+    assert ret[0] is False
+    assert isinstance(ret[1], OSError)
+    assert not conn.SocketConnected
+
+    # a second attempt fails the same way instead of using the dead stream
+    ret = await conn.connect()
+    assert ret[0] is False
+    assert conn._writer is None
+
+
+def test_connected_send():
+    asyncio.run(connected_send())
+
+
+def test_refused_connection():
+    asyncio.run(refused_connection())
+
+
+if __name__ == '__main__':
+    test_connected_send()
+    test_refused_connection()
+    print('ok')